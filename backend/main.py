@@ -1,12 +1,20 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Iterable
+import asyncio
 import os
 import time
-import json
+import hashlib
+import heapq
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
+from functools import lru_cache, partial
 from pathlib import Path
 from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv())
@@ -45,12 +53,14 @@ from langgraph.graph import StateGraph, END, START
 from langgraph.prebuilt import ToolNode
 from typing_extensions import TypedDict, Annotated
 import operator
-from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.messages import AIMessageChunk, BaseMessage, HumanMessage, SystemMessage
 from langchain_core.tools import tool
 from langchain_core.documents import Document
+from langchain_core.rate_limiters import InMemoryRateLimiter
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_community.vectorstores import InMemoryVectorStore
 import httpx
+import orjson
 
 
 class TripRequest(BaseModel):
@@ -69,6 +79,85 @@ class TripRequest(BaseModel):
 class TripResponse(BaseModel):
     result: str
     tool_calls: List[Dict[str, Any]] = []
+    # Set instead of result when a trip in a /plan-trips batch could not be planned
+    error: Optional[str] = None
+
+
+class ResponseCache:
+    """Thread-safe exact-match LRU cache with per-entry expiry.
+
+    Identical trip requests skip the multi-agent graph entirely and return
+    the previously generated itinerary from memory.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    @staticmethod
+    def key_for(req: TripRequest) -> bytes:
+        """Build a cache key from the fields that shape the itinerary."""
+        fields = (req.destination, req.duration, req.budget, req.interests, req.travel_style, req.user_input)
+        raw = "|".join((f or "").strip().lower() for f in fields)
+        return hashlib.blake2b(raw.encode(), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: bytes, value: Any) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+RESPONSE_CACHE = ResponseCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+)
+
+
+def _init_rate_limiter() -> Optional[InMemoryRateLimiter]:
+    """Token bucket that paces outbound LLM calls below the provider's rate limit.
+    
+    Shared by every agent in the process, so concurrent trips queue briefly
+    instead of tripping 429s. Set LLM_REQUESTS_PER_SECOND=0 to disable. The
+    budget is for the whole deployment, so it is divided across WEB_CONCURRENCY
+    worker processes.
+    """
+    workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    rate = float(os.getenv("LLM_REQUESTS_PER_SECOND", "8")) / workers
+    if rate <= 0:
+        return None
+    return InMemoryRateLimiter(
+        requests_per_second=rate,
+        check_every_n_seconds=0.05,
+        max_bucket_size=max(1.0, rate),
+    )
 
 
 def _init_llm():
@@ -86,8 +175,9 @@ def _init_llm():
 
     if os.getenv("TEST_MODE"):
         return _Fake()
+    rate_limiter = _init_rate_limiter()
     if os.getenv("OPENAI_API_KEY"):
-        return ChatOpenAI(model="gpt-3.5-turbo", temperature=0.7, max_tokens=1500)
+        return ChatOpenAI(model="gpt-3.5-turbo", temperature=0.7, max_tokens=1500, rate_limiter=rate_limiter)
     elif os.getenv("OPENROUTER_API_KEY"):
         # Use OpenRouter via OpenAI-compatible client
         return ChatOpenAI(
@@ -95,6 +185,7 @@ def _init_llm():
             base_url="https://openrouter.ai/api/v1",
             model=os.getenv("OPENROUTER_MODEL", "openai/gpt-4o-mini"),
             temperature=0.7,
+            rate_limiter=rate_limiter,
         )
     else:
         # Require a key unless running tests
@@ -114,12 +205,16 @@ def _load_local_documents(path: Path) -> List[Document]:
     if not path.exists():
         return []
     try:
-        raw = json.loads(path.read_text())
+        raw = orjson.loads(path.read_bytes())
     except Exception:
         return []
+    return _guides_to_documents(raw)
 
+
+def _guides_to_documents(rows: Iterable[Dict[str, Any]]) -> List[Document]:
+    """Convert local guide rows to LangChain Documents, skipping incomplete rows."""
     docs: List[Document] = []
-    for row in raw:
+    for row in rows:
         description = row.get("description")
         city = row.get("city")
         if not description or not city:
@@ -152,7 +247,27 @@ class LocalGuideRetriever:
         Args:
             data_path: Path to local_guides.json file
         """
-        self._docs = _load_local_documents(data_path)
+        self._index(_load_local_documents(data_path))
+
+    @classmethod
+    def from_iterable(cls, guides: Iterable[Dict[str, Any]]) -> "LocalGuideRetriever":
+        """Build a retriever from already-loaded guide rows, skipping file I/O."""
+        retriever = cls.__new__(cls)
+        retriever._index(_guides_to_documents(guides))
+        return retriever
+
+    def _index(self, docs: List[Document]) -> None:
+        """Store documents and build the vector index when RAG is available."""
+        self._docs = docs
+        # Lowercased (city, interests, content) per doc, so keyword queries skip re-lowering
+        self._keyword_fields = [
+            (
+                doc.metadata.get("city", "").lower(),
+                " ".join(doc.metadata.get("interests") or []).lower(),
+                doc.page_content.lower(),
+            )
+            for doc in docs
+        ]
         self._embeddings: Optional[OpenAIEmbeddings] = None
         self._vectorstore: Optional[InMemoryVectorStore] = None
         
@@ -229,34 +344,34 @@ class LocalGuideRetriever:
         fallback strategies in production systems.
         """
         dest_lower = destination.lower()
+        city_term = dest_lower.split(",")[0]
         interest_terms = [part.strip().lower() for part in (interests or "").split(",") if part.strip()]
 
-        def _score(doc: Document) -> int:
+        scored_docs = []
+        for doc, (city, doc_interests, content) in zip(self._docs, self._keyword_fields):
             score = 0
-            city_match = doc.metadata.get("city", "").lower()
             # Match city name
-            if dest_lower and dest_lower.split(",")[0] in city_match:
+            if dest_lower and city_term in city:
                 score += 2
             # Match interests
             for term in interest_terms:
-                if term and term in " ".join(doc.metadata.get("interests") or []).lower():
+                if term in doc_interests:
                     score += 1
-                if term and term in doc.page_content.lower():
+                if term in content:
                     score += 1
-            return score
+            if score > 0:
+                scored_docs.append((score, doc))
 
-        scored_docs = [(_score(doc), doc) for doc in self._docs]
-        scored_docs.sort(key=lambda item: item[0], reverse=True)
-        top_docs = scored_docs[:k]
+        # Partial selection is O(N log k) instead of a full sort; ties keep corpus order
+        top_docs = heapq.nlargest(k, scored_docs, key=operator.itemgetter(0))
         
         results = []
         for score, doc in top_docs:
-            if score > 0:
-                results.append({
-                    "content": doc.page_content,
-                    "metadata": doc.metadata,
-                    "score": float(score),
-                })
+            results.append({
+                "content": doc.page_content,
+                "metadata": doc.metadata,
+                "score": float(score),
+            })
         return results
 
 
@@ -265,15 +380,161 @@ _DATA_DIR = Path(__file__).parent / "data"
 GUIDE_RETRIEVER = LocalGuideRetriever(_DATA_DIR / "local_guides.json")
 
 
+# Feature flag for optional semantic response cache (opt-in, needs embeddings)
+ENABLE_SEMANTIC_CACHE = os.getenv("ENABLE_SEMANTIC_CACHE", "0").lower() not in {"0", "false", "no"}
+
+
+class SemanticResponseCache:
+    """Reuses itineraries for paraphrased requests via embedding similarity.
+
+    Sits below the exact-match ResponseCache: "Paris, France" with "food and
+    wine" and "paris" with "wine & food" embed close together, so the second
+    request can return the first one's itinerary without running the agents.
+    Only destination and interests are embedded; duration, budget and travel
+    style shape the whole itinerary, so they must match exactly.
+    """
+
+    def __init__(self, threshold: float = 0.95, maxsize: int = 1024, ttl: float = 86400.0):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._vectorstore: Optional[InMemoryVectorStore] = None
+
+        if ENABLE_SEMANTIC_CACHE and not os.getenv("TEST_MODE"):
+            try:
+                model = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
+                self._vectorstore = InMemoryVectorStore(embedding=OpenAIEmbeddings(model=model))
+            except Exception:
+                # Without embeddings the exact-match cache still applies
+                self._vectorstore = None
+
+    @staticmethod
+    def _query_text(req: TripRequest) -> str:
+        return f"{req.destination}\n{req.interests or 'general'}"
+
+    @staticmethod
+    def _exact_key(req: TripRequest) -> str:
+        """Normalized fields a cached itinerary must match exactly."""
+        fields = (req.duration, req.budget, req.travel_style)
+        return "|".join(" ".join((f or "").lower().split()) for f in fields)
+
+    def _doc_id(self, req: TripRequest) -> str:
+        # Deterministic, so re-storing the same request replaces its document
+        raw = f"{self._exact_key(req)}|{' '.join(self._query_text(req).lower().split())}"
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+    def lookup(self, req: TripRequest) -> Optional[TripResponse]:
+        """Return a stored response for a near-identical request, if any."""
+        # Free-form user input is too specific to share across requests
+        if self._vectorstore is None or req.user_input:
+            return None
+        exact = self._exact_key(req)
+        now = time.monotonic()
+        with self._lock:
+            expired = [doc_id for doc_id, (expires_at, _) in self._entries.items() if expires_at < now]
+            for doc_id in expired:
+                del self._entries[doc_id]
+            fresh = set(self._entries)
+        if expired:
+            self._vectorstore.delete(expired)
+        try:
+            # Expired or mismatched entries are filtered out, so they can't shadow a valid hit
+            hits = self._vectorstore.similarity_search_with_score(
+                self._query_text(req),
+                k=1,
+                filter=lambda doc: doc.id in fresh and doc.metadata.get("exact") == exact,
+            )
+        except Exception:
+            return None
+        if not hits:
+            return None
+        doc, score = hits[0]
+        if score < self.threshold:
+            return None
+        with self._lock:
+            entry = self._entries.get(doc.id)
+            return entry[1] if entry is not None else None
+
+    def store(self, req: TripRequest, response: TripResponse) -> None:
+        """Index a successful response under the request's embedding."""
+        if self._vectorstore is None or req.user_input:
+            return
+        doc_id = self._doc_id(req)
+        doc = Document(page_content=self._query_text(req), metadata={"exact": self._exact_key(req)})
+        try:
+            self._vectorstore.add_documents([doc], ids=[doc_id])
+        except Exception:
+            return
+        with self._lock:
+            self._entries[doc_id] = (time.monotonic() + self.ttl, response)
+            self._entries.move_to_end(doc_id)
+            evicted = []
+            while len(self._entries) > self.maxsize:
+                evicted.append(self._entries.popitem(last=False)[0])
+        if evicted:
+            self._vectorstore.delete(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            ids = list(self._entries)
+            self._entries.clear()
+        if self._vectorstore is not None and ids:
+            self._vectorstore.delete(ids)
+
+
+SEMANTIC_CACHE = SemanticResponseCache(
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+    ttl=float(os.getenv("SEMANTIC_CACHE_TTL", "86400")),
+)
+
+
 # Search API configuration and helpers
 SEARCH_TIMEOUT = 10.0  # seconds
 
+# Shared HTTP client so search calls reuse pooled TCP/TLS connections
+_HTTP_CLIENT: Optional[httpx.Client] = None
+# Agents and the search pool call _http_client from several threads at once
+_HTTP_CLIENT_LOCK = threading.Lock()
+
+
+def _http_client() -> httpx.Client:
+    """Return the shared search client, creating it on first use."""
+    global _HTTP_CLIENT
+    client = _HTTP_CLIENT
+    if client is not None and not client.is_closed:
+        return client
+    with _HTTP_CLIENT_LOCK:
+        if _HTTP_CLIENT is None or _HTTP_CLIENT.is_closed:
+            _HTTP_CLIENT = httpx.Client(
+                timeout=httpx.Timeout(SEARCH_TIMEOUT, connect=5.0),
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+            )
+        return _HTTP_CLIENT
+
+
+def _close_http_client() -> None:
+    """Close the shared search client (called on app shutdown)."""
+    global _HTTP_CLIENT
+    with _HTTP_CLIENT_LOCK:
+        if _HTTP_CLIENT is not None:
+            _HTTP_CLIENT.close()
+            _HTTP_CLIENT = None
+
 
 def _compact(text: str, limit: int = 200) -> str:
     """Compact text to a maximum length, truncating at word boundaries."""
     if not text:
         return ""
-    cleaned = " ".join(text.split())
+    # Collapsing whitespace only shrinks text, so normalize a growing prefix
+    # rather than the whole (possibly very long) search result
+    window = 2 * limit + 1
+    while True:
+        cleaned = " ".join(text[:window].split())
+        if len(cleaned) > limit or window >= len(text):
+            break
+        window *= 2
     if len(cleaned) <= limit:
         return cleaned
     truncated = cleaned[:limit]
@@ -283,6 +544,160 @@ def _compact(text: str, limit: int = 200) -> str:
     return truncated.rstrip(",.;- ")
 
 
+class CircuitBreaker:
+    """Fail fast on an upstream that keeps erroring or timing out.
+    
+    After ``fail_max`` consecutive upstream failures the breaker opens and
+    calls are skipped for ``reset_timeout`` seconds; then a single probe is
+    let through (half-open) and its outcome closes or re-opens the breaker.
+    """
+    
+    def __init__(self, fail_max: int = 5, reset_timeout: float = 30.0):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+    
+    def allow(self) -> bool:
+        """Return True if a call may go through right now."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+    
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+    
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.fail_max:
+                self._opened_at = time.monotonic()
+            self._probing = False
+    
+    def release(self) -> None:
+        """End a half-open probe whose outcome says nothing about upstream health."""
+        with self._lock:
+            self._probing = False
+
+
+def _is_upstream_failure(exc: Exception) -> bool:
+    """Only 5xx responses and timeouts/connection errors count against a breaker; 4xx means the API is up."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+
+def _record_search_error(breaker: CircuitBreaker, exc: Exception) -> None:
+    """Settle the breaker after a failed search call; every outcome releases a half-open probe."""
+    if _is_upstream_failure(exc):
+        breaker.record_failure()
+    elif isinstance(exc, httpx.HTTPStatusError):
+        breaker.record_success()  # A 4xx (e.g. 429) still means the API is reachable
+    else:
+        breaker.release()
+
+
+_SEARCH_BREAKERS = {"tavily": CircuitBreaker(), "serpapi": CircuitBreaker()}
+
+
+def _tavily_search(query: str, api_key: str) -> Optional[str]:
+    """Query Tavily (recommended for AI apps); None on any failure."""
+    breaker = _SEARCH_BREAKERS["tavily"]
+    if not breaker.allow():
+        return None  # Tavily is degraded; skip straight to the next option
+    try:
+        resp = _http_client().post(
+            "https://api.tavily.com/search",
+            json={
+                "api_key": api_key,
+                "query": query,
+                "max_results": 3,
+                "search_depth": "basic",
+                "include_answer": True,
+            },
+        )
+        resp.raise_for_status()
+        breaker.record_success()
+        data = orjson.loads(resp.content)
+        answer = data.get("answer") or ""
+        snippets = [
+            item.get("content") or item.get("snippet") or ""
+            for item in data.get("results", [])
+        ]
+        combined = " ".join([answer] + snippets).strip()
+        if combined:
+            return _compact(combined)
+    except Exception as exc:
+        # Fail gracefully, caller tries the next option
+        _record_search_error(breaker, exc)
+    return None
+
+
+def _serpapi_search(query: str, api_key: str) -> Optional[str]:
+    """Query SerpAPI's Google engine; None on any failure."""
+    breaker = _SEARCH_BREAKERS["serpapi"]
+    if not breaker.allow():
+        return None
+    try:
+        resp = _http_client().get(
+            "https://serpapi.com/search",
+            params={
+                "api_key": api_key,
+                "engine": "google",
+                "num": 5,
+                "q": query,
+            },
+        )
+        resp.raise_for_status()
+        breaker.record_success()
+        data = orjson.loads(resp.content)
+        organic = data.get("organic_results", [])
+        snippets = [item.get("snippet", "") for item in organic]
+        combined = " ".join(snippets).strip()
+        if combined:
+            return _compact(combined)
+    except Exception as exc:
+        # Fail gracefully
+        _record_search_error(breaker, exc)
+    return None
+
+
+# Opt-in: query every configured search API at once and keep the first answer
+SPECULATIVE_SEARCH = os.getenv("SPECULATIVE_SEARCH", "0").lower() not in {"0", "false", "no"}
+_SEARCH_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="search")
+
+
+def _first_search_result(providers: List[Callable[[], Optional[str]]]) -> Optional[str]:
+    """Run search providers concurrently and return the first non-empty result.
+    
+    Trades extra API quota for tail latency: a slow or timing-out provider
+    no longer delays the others.
+    """
+    pending = {_SEARCH_POOL.submit(provider) for provider in providers}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            result = future.result()
+            if result:
+                for straggler in pending:
+                    straggler.cancel()
+                return result
+    return None
+
+
 def _search_api(query: str) -> Optional[str]:
     """Search the web using Tavily or SerpAPI if configured, return None otherwise.
     
@@ -293,61 +708,29 @@ def _search_api(query: str) -> Optional[str]:
     if not query:
         return None
 
-    # Try Tavily first (recommended for AI apps)
+    # Tavily first, SerpAPI as fallback
+    providers: List[Callable[[], Optional[str]]] = []
     tavily_key = os.getenv("TAVILY_API_KEY")
     if tavily_key:
-        try:
-            with httpx.Client(timeout=SEARCH_TIMEOUT) as client:
-                resp = client.post(
-                    "https://api.tavily.com/search",
-                    json={
-                        "api_key": tavily_key,
-                        "query": query,
-                        "max_results": 3,
-                        "search_depth": "basic",
-                        "include_answer": True,
-                    },
-                )
-                resp.raise_for_status()
-                data = resp.json()
-                answer = data.get("answer") or ""
-                snippets = [
-                    item.get("content") or item.get("snippet") or ""
-                    for item in data.get("results", [])
-                ]
-                combined = " ".join([answer] + snippets).strip()
-                if combined:
-                    return _compact(combined)
-        except Exception:
-            pass  # Fail gracefully, try next option
-
-    # Try SerpAPI as fallback
+        providers.append(partial(_tavily_search, query, tavily_key))
     serp_key = os.getenv("SERPAPI_API_KEY")
     if serp_key:
-        try:
-            with httpx.Client(timeout=SEARCH_TIMEOUT) as client:
-                resp = client.get(
-                    "https://serpapi.com/search",
-                    params={
-                        "api_key": serp_key,
-                        "engine": "google",
-                        "num": 5,
-                        "q": query,
-                    },
-                )
-                resp.raise_for_status()
-                data = resp.json()
-                organic = data.get("organic_results", [])
-                snippets = [item.get("snippet", "") for item in organic]
-                combined = " ".join(snippets).strip()
-                if combined:
-                    return _compact(combined)
-        except Exception:
-            pass  # Fail gracefully
+        providers.append(partial(_serpapi_search, query, serp_key))
+
+    if SPECULATIVE_SEARCH and len(providers) > 1:
+        return _first_search_result(providers)
 
+    for provider in providers:
+        result = provider()
+        if result:
+            return result
     return None  # No search APIs configured
 
 
+# Static, shared by every fallback call; messages are never mutated after creation
+FALLBACK_SYSTEM_MESSAGE = SystemMessage(content="You are a concise travel assistant.")
+
+
 def _llm_fallback(instruction: str, context: Optional[str] = None) -> str:
     """Use the LLM to generate a response when search APIs aren't available.
     
@@ -357,7 +740,7 @@ def _llm_fallback(instruction: str, context: Optional[str] = None) -> str:
     if context:
         prompt += "\nContext:\n" + context.strip()
     response = llm.invoke([
-        SystemMessage(content="You are a concise travel assistant."),
+        FALLBACK_SYSTEM_MESSAGE,
         HumanMessage(content=prompt),
     ])
     return _compact(response.content)
@@ -508,6 +891,69 @@ def packing_list(destination: str, duration: str, activities: Optional[List[str]
     return _llm_fallback(instruction)
 
 
+# Agent prompt templates. Each agent sends a static system prompt first and the
+# per-request variables last, so the instructions live in one prebuilt message
+# rather than being re-formatted into every request.
+RESEARCH_SYSTEM_PROMPT = (
+    "You are a research assistant.\n"
+    "Gather essential information about the traveler's destination.\n"
+    "Use tools to get weather, visa, and essential info, then summarize."
+)
+RESEARCH_PROMPT = "Destination: {destination}"
+RESEARCH_SYNTHESIS_PROMPT = "Based on the above information, provide a comprehensive summary for the traveler."
+
+BUDGET_SYSTEM_PROMPT = (
+    "You are a budget analyst.\n"
+    "Analyze trip costs for the destination, duration, and budget provided.\n"
+    "Use tools to get pricing information, then provide a detailed breakdown."
+)
+BUDGET_PROMPT = "Destination: {destination}\nDuration: {duration}\nBudget: {budget}"
+BUDGET_SYNTHESIS_PROMPT = "Create a detailed budget breakdown for {duration} in {destination} with a {budget} budget."
+
+LOCAL_SYSTEM_PROMPT = (
+    "You are a local guide.\n"
+    "Find authentic experiences matching the traveler's interests and travel style.\n"
+    "Use tools to gather local insights."
+)
+LOCAL_PROMPT = "Destination: {destination}\nInterests: {interests}\nTravel style: {travel_style}"
+LOCAL_RAG_PROMPT = LOCAL_PROMPT + "\n\nRelevant curated experiences from our database:\n{context}"
+LOCAL_SYNTHESIS_PROMPT = "Create a curated list of authentic experiences for someone interested in {interests} with a {travel_style} approach."
+
+ITINERARY_SYSTEM_PROMPT = (
+    "You are an itinerary planner.\n"
+    "Combine the research, budget, and local inputs into a single itinerary.\n"
+    "Keep it under 100 words."
+)
+ITINERARY_PROMPT = "\n".join([
+    "Create a {duration} itinerary for {destination} ({travel_style}).",
+    "",
+    "Inputs:",
+    "Research: {research}",
+    "Budget: {budget}",
+    "Local: {local}",
+])
+ITINERARY_USER_INPUT_PROMPT = ITINERARY_PROMPT + "\nUser input: {user_input}"
+
+
+def _traced_template(system_prompt: str, template: str) -> str:
+    """The full prompt (instructions plus human template) as recorded for the Arize Playground."""
+    return f"{system_prompt}\n\n{template}"
+
+
+# Prebuilt system messages for the static prompts, shared across requests
+RESEARCH_SYSTEM_MESSAGE = SystemMessage(content=RESEARCH_SYSTEM_PROMPT)
+RESEARCH_SYNTHESIS_MESSAGE = SystemMessage(content=RESEARCH_SYNTHESIS_PROMPT)
+BUDGET_SYSTEM_MESSAGE = SystemMessage(content=BUDGET_SYSTEM_PROMPT)
+LOCAL_SYSTEM_MESSAGE = SystemMessage(content=LOCAL_SYSTEM_PROMPT)
+ITINERARY_SYSTEM_MESSAGE = SystemMessage(content=ITINERARY_SYSTEM_PROMPT)
+
+
+# Tools bound to each agent
+RESEARCH_TOOLS = [essential_info, weather_brief, visa_brief]
+BUDGET_TOOLS = [budget_basics, attraction_prices]
+LOCAL_TOOLS = [local_flavor, local_customs, hidden_gems]
+
+
 class TripState(TypedDict):
     messages: Annotated[List[BaseMessage], operator.add]
     trip_request: Dict[str, Any]
@@ -521,15 +967,11 @@ class TripState(TypedDict):
 def research_agent(state: TripState) -> TripState:
     req = state["trip_request"]
     destination = req["destination"]
-    prompt_t = (
-        "You are a research assistant.\n"
-        "Gather essential information about {destination}.\n"
-        "Use tools to get weather, visa, and essential info, then summarize."
-    )
+    prompt_t = RESEARCH_PROMPT
     vars_ = {"destination": destination}
     
-    messages = [SystemMessage(content=prompt_t.format(**vars_))]
-    tools = [essential_info, weather_brief, visa_brief]
+    messages = [RESEARCH_SYSTEM_MESSAGE, HumanMessage(content=prompt_t.format(**vars_))]
+    tools = RESEARCH_TOOLS
     agent = llm.bind_tools(tools)
     
     calls: List[Dict[str, Any]] = []
@@ -539,11 +981,13 @@ def research_agent(state: TripState) -> TripState:
     with using_attributes(tags=["research", "info_gathering"]):
         if _TRACING:
             current_span = trace.get_current_span()
-            if current_span:
-                current_span.set_attribute("metadata.agent_type", "research")
-                current_span.set_attribute("metadata.agent_node", "research_agent")
+            if current_span.is_recording():
+                current_span.set_attributes({
+                    "metadata.agent_type": "research",
+                    "metadata.agent_node": "research_agent",
+                })
         
-        with using_prompt_template(template=prompt_t, variables=vars_, version="v1"):
+        with using_prompt_template(template=_traced_template(RESEARCH_SYSTEM_PROMPT, prompt_t), variables=vars_, version="v1"):
             res = agent.invoke(messages)
     
     # Collect tool calls and execute them
@@ -559,12 +1003,11 @@ def research_agent(state: TripState) -> TripState:
         messages.append(res)
         messages.extend(tool_results)
         
-        synthesis_prompt = "Based on the above information, provide a comprehensive summary for the traveler."
-        messages.append(SystemMessage(content=synthesis_prompt))
+        messages.append(RESEARCH_SYNTHESIS_MESSAGE)
         
         # Instrument synthesis LLM call with its own prompt template
         synthesis_vars = {"destination": destination, "context": "tool_results"}
-        with using_prompt_template(template=synthesis_prompt, variables=synthesis_vars, version="v1-synthesis"):
+        with using_prompt_template(template=RESEARCH_SYNTHESIS_PROMPT, variables=synthesis_vars, version="v1-synthesis"):
             final_res = llm.invoke(messages)
         out = final_res.content
     else:
@@ -577,15 +1020,11 @@ def budget_agent(state: TripState) -> TripState:
     req = state["trip_request"]
     destination, duration = req["destination"], req["duration"]
     budget = req.get("budget", "moderate")
-    prompt_t = (
-        "You are a budget analyst.\n"
-        "Analyze costs for {destination} over {duration} with budget: {budget}.\n"
-        "Use tools to get pricing information, then provide a detailed breakdown."
-    )
+    prompt_t = BUDGET_PROMPT
     vars_ = {"destination": destination, "duration": duration, "budget": budget}
     
-    messages = [SystemMessage(content=prompt_t.format(**vars_))]
-    tools = [budget_basics, attraction_prices]
+    messages = [BUDGET_SYSTEM_MESSAGE, HumanMessage(content=prompt_t.format(**vars_))]
+    tools = BUDGET_TOOLS
     agent = llm.bind_tools(tools)
     
     calls: List[Dict[str, Any]] = []
@@ -594,11 +1033,13 @@ def budget_agent(state: TripState) -> TripState:
     with using_attributes(tags=["budget", "cost_analysis"]):
         if _TRACING:
             current_span = trace.get_current_span()
-            if current_span:
-                current_span.set_attribute("metadata.agent_type", "budget")
-                current_span.set_attribute("metadata.agent_node", "budget_agent")
+            if current_span.is_recording():
+                current_span.set_attributes({
+                    "metadata.agent_type": "budget",
+                    "metadata.agent_node": "budget_agent",
+                })
         
-        with using_prompt_template(template=prompt_t, variables=vars_, version="v1"):
+        with using_prompt_template(template=_traced_template(BUDGET_SYSTEM_PROMPT, prompt_t), variables=vars_, version="v1"):
             res = agent.invoke(messages)
     
     if getattr(res, "tool_calls", None):
@@ -612,12 +1053,10 @@ def budget_agent(state: TripState) -> TripState:
         messages.append(res)
         messages.extend(tr["messages"])
         
-        synthesis_prompt = f"Create a detailed budget breakdown for {duration} in {destination} with a {budget} budget."
-        messages.append(SystemMessage(content=synthesis_prompt))
-        
         # Instrument synthesis LLM call
         synthesis_vars = {"duration": duration, "destination": destination, "budget": budget}
-        with using_prompt_template(template=synthesis_prompt, variables=synthesis_vars, version="v1-synthesis"):
+        messages.append(SystemMessage(content=BUDGET_SYNTHESIS_PROMPT.format(**synthesis_vars)))
+        with using_prompt_template(template=BUDGET_SYNTHESIS_PROMPT, variables=synthesis_vars, version="v1-synthesis"):
             final_res = llm.invoke(messages)
         out = final_res.content
     else:
@@ -647,15 +1086,8 @@ def local_agent(state: TripState) -> TripState:
     
     context_text = "\n".join(context_lines) if context_lines else ""
     
-    prompt_t = (
-        "You are a local guide.\n"
-        "Find authentic experiences in {destination} for someone interested in: {interests}.\n"
-        "Travel style: {travel_style}. Use tools to gather local insights.\n"
-    )
-    
     # Add retrieved context to prompt if available
-    if context_text:
-        prompt_t += "\nRelevant curated experiences from our database:\n{context}\n"
+    prompt_t = LOCAL_RAG_PROMPT if context_text else LOCAL_PROMPT
     
     vars_ = {
         "destination": destination,
@@ -664,8 +1096,8 @@ def local_agent(state: TripState) -> TripState:
         "context": context_text if context_text else "No curated context available.",
     }
     
-    messages = [SystemMessage(content=prompt_t.format(**vars_))]
-    tools = [local_flavor, local_customs, hidden_gems]
+    messages = [LOCAL_SYSTEM_MESSAGE, HumanMessage(content=prompt_t.format(**vars_))]
+    tools = LOCAL_TOOLS
     agent = llm.bind_tools(tools)
     
     calls: List[Dict[str, Any]] = []
@@ -674,13 +1106,13 @@ def local_agent(state: TripState) -> TripState:
     with using_attributes(tags=["local", "local_experiences"]):
         if _TRACING:
             current_span = trace.get_current_span()
-            if current_span:
-                current_span.set_attribute("metadata.agent_type", "local")
-                current_span.set_attribute("metadata.agent_node", "local_agent")
+            if current_span.is_recording():
+                span_attrs = {"metadata.agent_type": "local", "metadata.agent_node": "local_agent"}
                 if ENABLE_RAG and context_text:
-                    current_span.set_attribute("metadata.rag_enabled", "true")
+                    span_attrs["metadata.rag_enabled"] = "true"
+                current_span.set_attributes(span_attrs)
         
-        with using_prompt_template(template=prompt_t, variables=vars_, version="v1"):
+        with using_prompt_template(template=_traced_template(LOCAL_SYSTEM_PROMPT, prompt_t), variables=vars_, version="v1"):
             res = agent.invoke(messages)
     
     if getattr(res, "tool_calls", None):
@@ -694,12 +1126,10 @@ def local_agent(state: TripState) -> TripState:
         messages.append(res)
         messages.extend(tr["messages"])
         
-        synthesis_prompt = f"Create a curated list of authentic experiences for someone interested in {interests} with a {travel_style} approach."
-        messages.append(SystemMessage(content=synthesis_prompt))
-        
         # Instrument synthesis LLM call
         synthesis_vars = {"interests": interests, "travel_style": travel_style, "destination": destination}
-        with using_prompt_template(template=synthesis_prompt, variables=synthesis_vars, version="v1-synthesis"):
+        messages.append(SystemMessage(content=LOCAL_SYNTHESIS_PROMPT.format(**synthesis_vars)))
+        with using_prompt_template(template=LOCAL_SYNTHESIS_PROMPT, variables=synthesis_vars, version="v1-synthesis"):
             final_res = llm.invoke(messages)
         out = final_res.content
     else:
@@ -715,20 +1145,7 @@ def itinerary_agent(state: TripState) -> TripState:
     travel_style = req.get("travel_style", "standard")
     user_input = (req.get("user_input") or "").strip()
     
-    prompt_parts = [
-        "Create a {duration} itinerary for {destination} ({travel_style}).",
-        "",
-        "Inputs:",
-        "Research: {research}",
-        "Budget: {budget}",
-        "Local: {local}",
-        "",
-        "Keep it under 100 words.",
-    ]
-    if user_input:
-        prompt_parts.append("User input: {user_input}")
-    
-    prompt_t = "\n".join(prompt_parts)
+    prompt_t = ITINERARY_USER_INPUT_PROMPT if user_input else ITINERARY_PROMPT
     vars_ = {
         "duration": duration,
         "destination": destination,
@@ -744,16 +1161,22 @@ def itinerary_agent(state: TripState) -> TripState:
     with using_attributes(tags=["itinerary", "final_agent"]):
         if _TRACING:
             current_span = trace.get_current_span()
-            if current_span:
-                current_span.set_attribute("metadata.itinerary", "true")
-                current_span.set_attribute("metadata.agent_type", "itinerary")
-                current_span.set_attribute("metadata.agent_node", "itinerary_agent")
+            if current_span.is_recording():
+                span_attrs = {
+                    "metadata.itinerary": "true",
+                    "metadata.agent_type": "itinerary",
+                    "metadata.agent_node": "itinerary_agent",
+                }
                 if user_input:
-                    current_span.set_attribute("metadata.user_input", user_input)
+                    span_attrs["metadata.user_input"] = user_input
+                current_span.set_attributes(span_attrs)
         
         # Prompt template wrapper for Arize Playground integration
-        with using_prompt_template(template=prompt_t, variables=vars_, version="v1"):
-            res = llm.invoke([SystemMessage(content=prompt_t.format(**vars_))])
+        with using_prompt_template(template=_traced_template(ITINERARY_SYSTEM_PROMPT, prompt_t), variables=vars_, version="v1"):
+            res = llm.invoke([
+                ITINERARY_SYSTEM_MESSAGE,
+                HumanMessage(content=prompt_t.format(**vars_)),
+            ])
     
     return {"messages": [SystemMessage(content=res.content)], "final": res.content}
 
@@ -781,7 +1204,23 @@ def build_graph():
     return g.compile()
 
 
-app = FastAPI(title="AI Trip Planner")
+@lru_cache(maxsize=1)
+def _get_graph():
+    """Compile the workflow once per process; the compiled graph keeps no per-request state."""
+    return build_graph()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open pooled search connections at startup, release them on shutdown
+    _http_client()
+    try:
+        yield
+    finally:
+        _close_http_client()
+
+
+app = FastAPI(title="AI Trip Planner", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -791,18 +1230,25 @@ app.add_middleware(
 )
 
 
+# Resolve the UI file once at startup instead of stat()-ing it on every request
+FRONTEND_PATH = Path(__file__).resolve().parent.parent / "frontend" / "index.html"
+FRONTEND_EXISTS = FRONTEND_PATH.is_file()
+
+
 @app.get("/")
 def serve_frontend():
-    here = os.path.dirname(__file__)
-    path = os.path.join(here, "..", "frontend", "index.html")
-    if os.path.exists(path):
-        return FileResponse(path)
+    if FRONTEND_EXISTS:
+        return FileResponse(FRONTEND_PATH)
     return {"message": "frontend/index.html not found"}
 
 
+# The health body never changes, so encode it once instead of on every probe
+_HEALTH_BODY = orjson.dumps({"status": "healthy", "service": "ai-trip-planner"})
+
+
 @app.get("/health")
 def health():
-    return {"status": "healthy", "service": "ai-trip-planner"}
+    return Response(content=_HEALTH_BODY, media_type="application/json")
 
 
 # Initialize tracing once at startup, not per request
@@ -811,50 +1257,238 @@ if _TRACING:
         space_id = os.getenv("ARIZE_SPACE_ID")
         api_key = os.getenv("ARIZE_API_KEY")
         if space_id and api_key:
-            tp = register(space_id=space_id, api_key=api_key, project_name="ai-trip-planner")
+            # Head sampling: the SDK reads the sampler from the standard OTEL env vars
+            sample_rate = os.getenv("TRACE_SAMPLE_RATE")
+            if sample_rate:
+                os.environ.setdefault("OTEL_TRACES_SAMPLER", "parentbased_traceidratio")
+                os.environ.setdefault("OTEL_TRACES_SAMPLER_ARG", sample_rate)
+            # batch=True exports spans from a background BatchSpanProcessor, off the request path
+            tp = register(space_id=space_id, api_key=api_key, project_name="ai-trip-planner", batch=True)
             LangChainInstrumentor().instrument(tracer_provider=tp, include_chains=True, include_agents=True, include_tools=True)
             LiteLLMInstrumentor().instrument(tracer_provider=tp, skip_dep_check=True)
     except Exception:
         pass
 
-@app.post("/plan-trip", response_model=TripResponse)
-def plan_trip(req: TripRequest):
-    graph = build_graph()
-    
+def _cached_response(req: TripRequest, cache_key: bytes) -> Optional[TripResponse]:
+    """Look up a previous itinerary in the exact-match, then semantic, cache."""
+    cached = RESPONSE_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    cached = SEMANTIC_CACHE.lookup(req)
+    if cached is not None:
+        RESPONSE_CACHE.set(cache_key, cached)
+    return cached
+
+
+def _remember_response(req: TripRequest, cache_key: bytes, response: TripResponse) -> None:
+    # Don't memoize empty results so transient failures get retried
+    if response.result:
+        RESPONSE_CACHE.set(cache_key, response)
+        SEMANTIC_CACHE.store(req, response)
+
+
+# The semantic cache embeds each request over HTTP, so async handlers must not call these on the event loop
+async def _cached_response_async(req: TripRequest, cache_key: bytes) -> Optional[TripResponse]:
+    return await run_in_threadpool(_cached_response, req, cache_key)
+
+
+async def _remember_response_async(req: TripRequest, cache_key: bytes, response: TripResponse) -> None:
+    await run_in_threadpool(_remember_response, req, cache_key, response)
+
+
+def _initial_state(req: TripRequest) -> Dict[str, Any]:
     # Only include necessary fields in initial state
     # Agent outputs (research, budget, local, final) will be added during execution
-    state = {
+    return {
         "messages": [],
         "trip_request": req.model_dump(),
         "tool_calls": [],
     }
-    
-    # Add session and user tracking attributes to the trace
-    session_id = req.session_id
-    user_id = req.user_id
-    turn_idx = req.turn_index
-    
-    # Build attributes for session and user tracking
+
+
+@contextmanager
+def _request_attributes(req: TripRequest):
+    """Attach session and user tracking attributes to the trace."""
     attrs_kwargs = {}
-    if session_id:
-        attrs_kwargs["session_id"] = session_id
-    if user_id:
-        attrs_kwargs["user_id"] = user_id
-    
-    # Add turn_index as a custom span attribute if provided
-    if turn_idx is not None and _TRACING:
-        with using_attributes(**attrs_kwargs):
+    if req.session_id:
+        attrs_kwargs["session_id"] = req.session_id
+    if req.user_id:
+        attrs_kwargs["user_id"] = req.user_id
+    
+    with using_attributes(**attrs_kwargs):
+        # Add turn_index as a custom span attribute if provided
+        if req.turn_index is not None and _TRACING:
             current_span = trace.get_current_span()
-            if current_span:
-                current_span.set_attribute("turn_index", turn_idx)
-            out = graph.invoke(state)
-    else:
-        with using_attributes(**attrs_kwargs):
-            out = graph.invoke(state)
+            if current_span.is_recording():
+                current_span.set_attribute("turn_index", req.turn_index)
+        yield
+
+
+def _sse(payload: Dict[str, Any]) -> bytes:
+    """Encode one Server-Sent Events frame.
+    
+    orjson writes UTF-8 bytes directly, so frames skip both the stdlib
+    encoder and Starlette's str-to-bytes re-encode on the streaming path.
+    """
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+@app.post("/plan-trip", response_model=TripResponse)
+async def plan_trip(req: TripRequest):
+    # Serve repeated requests from memory instead of re-running every agent
+    cache_key = RESPONSE_CACHE.key_for(req)
+    cached = await _cached_response_async(req, cache_key)
+    if cached is not None:
+        return cached
+
+    graph = _get_graph()
+    with _request_attributes(req):
+        # ainvoke keeps the request on the event loop; sync agent nodes run in LangGraph's executor
+        out = await graph.ainvoke(_initial_state(req))
+    
+    response = TripResponse(result=out.get("final", ""), tool_calls=out.get("tool_calls", []))
+    await _remember_response_async(req, cache_key, response)
+    return response
+
+
+# Bounds for POST /plan-trips (each trip fans out to ~7 LLM calls)
+MAX_BATCH_TRIPS = int(os.getenv("MAX_BATCH_TRIPS", "10"))
+MAX_BATCH_CONCURRENCY = int(os.getenv("MAX_BATCH_CONCURRENCY", "4"))
+
+
+@app.post("/plan-trips", response_model=List[TripResponse])
+async def plan_trips(reqs: List[TripRequest]):
+    """Plan several trips concurrently; results are returned in request order.
     
-    return TripResponse(result=out.get("final", ""), tool_calls=out.get("tool_calls", []))
+    A trip whose graph run raises comes back with ``error`` set and an empty
+    result, so one failure doesn't discard the rest of the batch.
+    """
+    if len(reqs) > MAX_BATCH_TRIPS:
+        raise HTTPException(status_code=422, detail=f"At most {MAX_BATCH_TRIPS} trips per request")
+    
+    cache_keys = [RESPONSE_CACHE.key_for(req) for req in reqs]
+    responses: List[Optional[TripResponse]] = [
+        await _cached_response_async(req, key) for req, key in zip(reqs, cache_keys)
+    ]
+    misses = [i for i, response in enumerate(responses) if response is None]
+    
+    if misses:
+        graph = _get_graph()
+        # Identical trips in one batch share a single graph run
+        first_miss: Dict[bytes, int] = {}
+        for i in misses:
+            first_miss.setdefault(cache_keys[i], i)
+        # Cap concurrent runs; the shared LLM rate limiter still applies
+        semaphore = asyncio.Semaphore(MAX_BATCH_CONCURRENCY)
+        
+        async def run(i: int) -> TripResponse:
+            async with semaphore:
+                # Each run keeps its own session/user/turn tracing attributes
+                with _request_attributes(reqs[i]):
+                    out = await graph.ainvoke(_initial_state(reqs[i]))
+            response = TripResponse(result=out.get("final", ""), tool_calls=out.get("tool_calls", []))
+            await _remember_response_async(reqs[i], cache_keys[i], response)
+            return response
+        
+        outcomes = await asyncio.gather(*(run(i) for i in first_miss.values()), return_exceptions=True)
+        planned: Dict[bytes, TripResponse] = {}
+        for key, outcome in zip(first_miss, outcomes):
+            # A failed trip is reported in its own slot; the others already ran and were cached
+            if isinstance(outcome, BaseException):
+                outcome = TripResponse(result="", error=f"Trip planning failed ({type(outcome).__name__})")
+            planned[key] = outcome
+        for i in misses:
+            responses[i] = planned[cache_keys[i]]
+    
+    return responses
+
+
+_AGENT_NODES = {"research_node": "research", "budget_node": "budget", "local_node": "local"}
+
+# Coalesce itinerary tokens into fewer SSE frames (50 ms is below what readers notice)
+STREAM_FLUSH_CHARS = 256
+STREAM_FLUSH_INTERVAL = 0.05  # seconds
+
+
+@app.post("/plan-trip-stream")
+async def plan_trip_stream(req: TripRequest):
+    """Stream agent progress and itinerary tokens as Server-Sent Events.
+    
+    Events, in order:
+    - {"agent": ..., "tool_calls": [...]} as each parallel agent finishes
+    - {"content": ...} itinerary text deltas, batched every ~50 ms or 256 chars
+    - {"result": ..., "tool_calls": [...]} with the complete response, or
+      {"error": ...} instead if planning fails partway through
+    """
+    cache_key = RESPONSE_CACHE.key_for(req)
+    
+    async def events():
+        cached = await _cached_response_async(req, cache_key)
+        if cached is not None:
+            yield _sse({"content": cached.result})
+            yield _sse(cached.model_dump(exclude_none=True))
+            return
+        
+        graph = _get_graph()
+        final = ""
+        tool_calls: List[Dict[str, Any]] = []
+        pending: List[str] = []
+        pending_chars = 0
+        last_flush = time.monotonic()
+        try:
+            with _request_attributes(req):
+                async for mode, chunk in graph.astream(_initial_state(req), stream_mode=["updates", "messages"]):
+                    if mode == "messages":
+                        message, metadata = chunk
+                        # Only the itinerary agent's tokens are user-facing text
+                        if (
+                            isinstance(message, AIMessageChunk)
+                            and message.content
+                            and metadata.get("langgraph_node") == "itinerary_node"
+                        ):
+                            pending.append(message.content)
+                            pending_chars += len(message.content)
+                            now = time.monotonic()
+                            if pending_chars >= STREAM_FLUSH_CHARS or now - last_flush >= STREAM_FLUSH_INTERVAL:
+                                yield _sse({"content": "".join(pending)})
+                                pending.clear()
+                                pending_chars = 0
+                                last_flush = now
+                        continue
+                    if pending:
+                        yield _sse({"content": "".join(pending)})
+                        pending.clear()
+                        pending_chars = 0
+                    for node, update in chunk.items():
+                        update = update or {}
+                        tool_calls.extend(update.get("tool_calls") or [])
+                        if node in _AGENT_NODES:
+                            yield _sse({"agent": _AGENT_NODES[node], "tool_calls": update.get("tool_calls") or []})
+                        elif node == "itinerary_node":
+                            final = update.get("final") or ""
+        except Exception as exc:
+            # Headers are already sent, so end the stream with an explicit error event
+            yield _sse({"error": f"Trip planning failed ({type(exc).__name__})"})
+            return
+        
+        response = TripResponse(result=final, tool_calls=tool_calls)
+        await _remember_response_async(req, cache_key, response)
+        yield _sse(response.model_dump(exclude_none=True))
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 
 if __name__ == "__main__":
+    import importlib.util
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvloop/httptools ship with uvicorn[standard] but not on every platform (no
+    # uvloop on Windows). Caches, rate limiter and circuit breakers are per
+    # process; the rate limiter splits LLM_REQUESTS_PER_SECOND across workers.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "auto",
+        http="httptools" if importlib.util.find_spec("httptools") else "auto",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+    )
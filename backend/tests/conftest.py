@@ -1,181 +1,273 @@
 """Shared pytest fixtures and test configuration."""
 
+import copy
 import os
-import json
-import tempfile
-from pathlib import Path
+from dataclasses import dataclass, field
+from types import MappingProxyType
 from typing import Dict, Any, Optional
-from unittest.mock import Mock, MagicMock
 
+import httpx
 import pytest
-from fastapi.testclient import TestClient
-from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+import pytest_asyncio
+
+from tests.fixtures.sample_data import (
+    SAMPLE_EMPTY_GUIDES_JSON,
+    SAMPLE_LOCAL_GUIDES,
+    SAMPLE_LOCAL_GUIDES_JSON,
+    SAMPLE_MALFORMED_GUIDES_JSON,
+    SAMPLE_TRIP_REQUEST,
+    SAMPLE_TRIP_REQUEST_MINIMAL,
+    SAMPLE_TRIP_REQUEST_RO,
+)
+
+
+def pytest_configure(config):
+    """Set up the test environment once, before any test module imports main."""
+    # TEST_MODE enables the fake LLM; RAG stays off unless a test enables it
+    os.environ["TEST_MODE"] = "1"
+    for key in ("OPENAI_API_KEY", "OPENROUTER_API_KEY", "ENABLE_RAG"):
+        os.environ.pop(key, None)
+    # Without Arize credentials main never registers a tracer or instruments LangChain
+    for key in ("ARIZE_SPACE_ID", "ARIZE_API_KEY"):
+        os.environ.pop(key, None)
+    # Keep LangChain from setting up LangSmith tracing or background callbacks
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+    os.environ["LANGCHAIN_CALLBACKS_BACKGROUND"] = "false"
+
+
+@pytest.fixture(scope="session")
+def main_module():
+    """The main module, imported once after pytest_configure has set TEST_MODE."""
+    import main
+    return main
 
-# Set TEST_MODE before importing main to enable fake LLM
-os.environ["TEST_MODE"] = "1"
-os.environ.pop("OPENAI_API_KEY", None)
-os.environ.pop("OPENROUTER_API_KEY", None)
-os.environ.pop("ENABLE_RAG", None)
 
-from main import app, TripRequest, LocalGuideRetriever
-from tests.fixtures.sample_data import SAMPLE_LOCAL_GUIDES, SAMPLE_TRIP_REQUEST
+@pytest.fixture(scope="module")
+def compiled_graph(main_module):
+    """Graph compiled once per module.
+    
+    Each node looks up ``main.<agent>`` when it runs, so tests can still swap
+    agents with monkeypatch after the graph has been built.
+    """
+    def dispatch(name):
+        def node(state):
+            return getattr(main_module, name)(state)
+        return node
+    
+    with pytest.MonkeyPatch.context() as mp:
+        for name in ("research_agent", "budget_agent", "local_agent", "itinerary_agent"):
+            mp.setattr(main_module, name, dispatch(name))
+        return main_module.build_graph()
 
 
-@pytest.fixture(scope="session", autouse=True)
-def setup_test_environment():
-    """Set up test environment variables for the entire test session."""
-    # Ensure TEST_MODE is set
-    os.environ["TEST_MODE"] = "1"
-    # Disable RAG by default unless explicitly enabled in test
-    os.environ.pop("ENABLE_RAG", None)
+@pytest.fixture
+def patched_agents(main_module, monkeypatch):
+    """Swap all four agents in main for the given callables; reverted at teardown."""
+    def apply(research, budget, local, itinerary):
+        for name, fn in (
+            ("research_agent", research),
+            ("budget_agent", budget),
+            ("local_agent", local),
+            ("itinerary_agent", itinerary),
+        ):
+            monkeypatch.setattr(main_module, name, fn)
+    return apply
+
+
+@pytest.fixture(autouse=True)
+def clear_response_cache(main_module):
+    """Start every test with empty itinerary response caches."""
+    main_module.RESPONSE_CACHE.clear()
+    main_module.SEMANTIC_CACHE.clear()
     yield
-    # Cleanup
-    os.environ.pop("TEST_MODE", None)
+    main_module.RESPONSE_CACHE.clear()
+    main_module.SEMANTIC_CACHE.clear()
 
 
-@pytest.fixture
-def test_client():
-    """FastAPI TestClient instance."""
-    return TestClient(app)
+@pytest.fixture(scope="session")
+def test_client(main_module):
+    """FastAPI TestClient shared by the whole session; startup/shutdown run once."""
+    from fastapi.testclient import TestClient
+    
+    with TestClient(main_module.app) as client:
+        yield client
 
 
-@pytest.fixture
+@pytest_asyncio.fixture
+async def async_client(main_module):
+    """httpx AsyncClient calling the app in-process, so async endpoints run on the test's loop."""
+    transport = httpx.ASGITransport(app=main_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
 def sample_trip_request():
-    """Sample TripRequest data."""
+    """Sample TripRequest data, shared by the session; build variants with {**...}."""
     return SAMPLE_TRIP_REQUEST.copy()
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_trip_request_minimal():
-    """Minimal TripRequest with only required fields."""
-    return {
-        "destination": "Tokyo, Japan",
-        "duration": "7 days"
-    }
+    """Minimal TripRequest with only required fields, shared by the session."""
+    return dict(SAMPLE_TRIP_REQUEST_MINIMAL)
 
 
-@pytest.fixture
-def mock_llm_response():
-    """Mock LLM response object."""
-    class MockResponse:
-        def __init__(self, content: str = "Test response", tool_calls: Optional[list] = None):
-            self.content = content
-            self.tool_calls = tool_calls or []
+@dataclass
+class StubResponse:
+    """Minimal stand-in for an LLM response message."""
+    content: str = ""
+    tool_calls: list = field(default_factory=list)
+
+
+class StubLLM:
+    """Plain LLM stand-in that returns canned responses in order.
+    
+    The last response repeats once the list runs out. Records the tools bound
+    and the messages sent to each invoke call.
+    """
+    __slots__ = ("_responses", "bound_tools", "calls")
+    
+    def __init__(self, responses: list):
+        self._responses = list(responses)
+        self.bound_tools: Optional[list] = None
+        self.calls: list = []
+    
+    def bind_tools(self, tools):
+        self.bound_tools = list(tools)
+        return self
     
-    return MockResponse
+    def invoke(self, messages):
+        self.calls.append(messages)
+        return self._responses[min(len(self.calls), len(self._responses)) - 1]
 
 
 @pytest.fixture
-def mock_llm_with_tool_calls():
-    """Mock LLM that returns tool calls."""
-    def create_mock_llm(tool_calls: list):
-        mock_llm = Mock()
-        mock_response = Mock()
-        mock_response.content = ""
-        mock_response.tool_calls = tool_calls
-        mock_llm.invoke = Mock(return_value=mock_response)
-        mock_llm.bind_tools = Mock(return_value=mock_llm)
-        return mock_llm
+def mock_llm_factory():
+    """Build a StubLLM.
+    
+    The first invoke returns ``content``/``tool_calls``; pass ``synthesis`` to
+    return a second response (the post-tool synthesis call) after it.
+    """
+    def create_mock_llm(content: str = "", tool_calls: Optional[list] = None, synthesis: Optional[str] = None):
+        responses = [StubResponse(content, tool_calls or [])]
+        if synthesis is not None:
+            responses.append(StubResponse(synthesis))
+        return StubLLM(responses)
     return create_mock_llm
 
 
+def _search_success(query: str) -> Optional[str]:
+    """Canned _search_api stand-in that always finds a result."""
+    return f"Mock search result for: {query[:50]}"
+
+
+def _search_failure(query: str) -> Optional[str]:
+    """Canned _search_api stand-in that never finds a result."""
+    return None
+
+
+def _llm_fallback_stub(instruction: str, context: Optional[str] = None) -> str:
+    """Canned _llm_fallback stand-in with a recognizable prefix."""
+    return f"LLM fallback response for: {instruction[:50]}"
+
+
 @pytest.fixture
-def mock_search_api_success(monkeypatch):
+def mock_search_api_success(main_module, monkeypatch):
     """Mock _search_api to return successful results."""
-    def mock_search(query: str) -> Optional[str]:
-        return f"Mock search result for: {query[:50]}"
-    
-    import main
-    monkeypatch.setattr(main, "_search_api", mock_search)
-    return mock_search
+    monkeypatch.setattr(main_module, "_search_api", _search_success)
+    return _search_success
 
 
 @pytest.fixture
-def mock_search_api_failure(monkeypatch):
+def mock_search_api_failure(main_module, monkeypatch):
     """Mock _search_api to return None (triggers LLM fallback)."""
-    def mock_search(query: str) -> Optional[str]:
-        return None
-    
-    import main
-    monkeypatch.setattr(main, "_search_api", mock_search)
-    return mock_search
+    monkeypatch.setattr(main_module, "_search_api", _search_failure)
+    return _search_failure
 
 
 @pytest.fixture
-def mock_llm_fallback(monkeypatch):
+def mock_llm_fallback(main_module, monkeypatch):
     """Mock _llm_fallback to return predictable responses."""
-    def mock_fallback(instruction: str, context: Optional[str] = None) -> str:
-        return f"LLM fallback response for: {instruction[:50]}"
-    
-    import main
-    monkeypatch.setattr(main, "_llm_fallback", mock_fallback)
-    return mock_fallback
+    monkeypatch.setattr(main_module, "_llm_fallback", _llm_fallback_stub)
+    return _llm_fallback_stub
 
 
-@pytest.fixture
-def temp_local_guides_file(tmp_path):
+@pytest.fixture(scope="session")
+def guides_dir(tmp_path_factory):
+    """Session-wide directory for read-only guide files."""
+    return tmp_path_factory.mktemp("guides")
+
+
+@pytest.fixture(scope="session")
+def temp_local_guides_file(guides_dir):
     """Create a temporary local_guides.json file for testing."""
-    guides_file = tmp_path / "local_guides.json"
-    guides_file.write_text(json.dumps(SAMPLE_LOCAL_GUIDES, indent=2))
+    guides_file = guides_dir / "local_guides.json"
+    guides_file.write_bytes(SAMPLE_LOCAL_GUIDES_JSON)
     return guides_file
 
 
-@pytest.fixture
-def temp_empty_guides_file(tmp_path):
+@pytest.fixture(scope="session")
+def temp_empty_guides_file(guides_dir):
     """Create an empty local_guides.json file."""
-    guides_file = tmp_path / "local_guides.json"
-    guides_file.write_text(json.dumps([], indent=2))
+    guides_file = guides_dir / "empty_guides.json"
+    guides_file.write_bytes(SAMPLE_EMPTY_GUIDES_JSON)
     return guides_file
 
 
-@pytest.fixture
-def temp_malformed_guides_file(tmp_path):
+@pytest.fixture(scope="session")
+def temp_malformed_guides_file(guides_dir):
     """Create a malformed JSON file."""
-    guides_file = tmp_path / "local_guides.json"
-    guides_file.write_text("{ invalid json }")
+    guides_file = guides_dir / "malformed_guides.json"
+    guides_file.write_bytes(SAMPLE_MALFORMED_GUIDES_JSON)
     return guides_file
 
 
-@pytest.fixture
-def temp_nonexistent_file(tmp_path):
+@pytest.fixture(scope="session")
+def temp_nonexistent_file(guides_dir):
     """Return path to a non-existent file."""
-    return tmp_path / "nonexistent.json"
+    return guides_dir / "nonexistent.json"
 
 
-@pytest.fixture
-def mock_retriever_with_data():
-    """Create a LocalGuideRetriever with sample data."""
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-        json.dump(SAMPLE_LOCAL_GUIDES, f)
-        temp_path = Path(f.name)
-    
-    retriever = LocalGuideRetriever(temp_path)
-    yield retriever
+@pytest.fixture(scope="class")
+def rag_enabled(main_module):
+    """Turn RAG on for a whole test class.
     
-    # Cleanup
-    temp_path.unlink()
+    main reads ENABLE_RAG once at import, so setting the env var per test has
+    no effect; flip the module flag instead and restore it after the class.
+    """
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(main_module, "ENABLE_RAG", True)
+        yield
+
+
+@pytest.fixture(scope="session")
+def mock_retriever_with_data(main_module):
+    """LocalGuideRetriever with sample data, built once per session (read-only)."""
+    return main_module.LocalGuideRetriever.from_iterable(SAMPLE_LOCAL_GUIDES)
 
 
 @pytest.fixture
-def mock_retriever_empty():
-    """Create an empty LocalGuideRetriever."""
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-        json.dump([], f)
-        temp_path = Path(f.name)
-    
-    retriever = LocalGuideRetriever(temp_path)
-    yield retriever
-    
-    # Cleanup
-    temp_path.unlink()
+def mock_retriever_fresh(mock_retriever_with_data):
+    """Per-test copy of the session retriever, for tests that mutate it."""
+    retriever = copy.copy(mock_retriever_with_data)
+    retriever._docs = list(mock_retriever_with_data._docs)
+    return retriever
+
+
+@pytest.fixture(scope="session")
+def mock_retriever_empty(main_module):
+    """Empty LocalGuideRetriever, built once per session (read-only)."""
+    return main_module.LocalGuideRetriever.from_iterable([])
 
 
 @pytest.fixture
 def mock_tool_node(monkeypatch):
-    """Mock ToolNode.invoke to return predictable tool results."""
-    from langchain_core.messages import AIMessage, ToolMessage
+    """Mock ToolNode.invoke to return predictable tool results; reverted at teardown."""
+    from langchain_core.messages import ToolMessage
+    from langgraph.prebuilt import ToolNode
     
-    def mock_invoke(state: Dict[str, Any]) -> Dict[str, Any]:
+    def mock_invoke(self, state: Dict[str, Any], *args, **kwargs) -> Dict[str, Any]:
         messages = state.get("messages", [])
         tool_results = []
         for msg in messages:
@@ -188,11 +280,8 @@ def mock_tool_node(monkeypatch):
                     tool_results.append(tool_result)
         return {"messages": tool_results}
     
-    from langgraph.prebuilt import ToolNode
-    original_invoke = ToolNode.invoke
-    ToolNode.invoke = mock_invoke
-    yield mock_invoke
-    ToolNode.invoke = original_invoke
+    monkeypatch.setattr(ToolNode, "invoke", mock_invoke)
+    return mock_invoke
 
 
 @pytest.fixture
@@ -200,7 +289,7 @@ def sample_trip_state():
     """Sample TripState for testing agents."""
     return {
         "messages": [],
-        "trip_request": SAMPLE_TRIP_REQUEST.copy(),
+        "trip_request": dict(SAMPLE_TRIP_REQUEST_RO),
         "research": None,
         "budget": None,
         "local": None,
@@ -208,3 +297,26 @@ def sample_trip_state():
         "tool_calls": []
     }
 
+
+@pytest.fixture
+def initial_state(sample_trip_state):
+    """Initial graph input built from the sample trip request."""
+    return {
+        "messages": [],
+        "trip_request": sample_trip_state["trip_request"],
+        "tool_calls": []
+    }
+
+
+@pytest.fixture(scope="session")
+def sample_trip_state_ro():
+    """Read-only TripState shared across tests that don't mutate it."""
+    return MappingProxyType({
+        "messages": (),
+        "trip_request": SAMPLE_TRIP_REQUEST_RO,
+        "research": None,
+        "budget": None,
+        "local": None,
+        "final": None,
+        "tool_calls": ()
+    })
@@ -1,5 +1,9 @@
 """Sample test data fixtures for testing."""
 
+from types import MappingProxyType
+
+import orjson
+
 SAMPLE_LOCAL_GUIDES = [
     {
         "city": "Tokyo",
@@ -33,6 +37,11 @@ SAMPLE_LOCAL_GUIDES = [
     }
 ]
 
+# Serialized once at import; fixtures write these bytes instead of re-dumping per test
+SAMPLE_LOCAL_GUIDES_JSON = orjson.dumps(SAMPLE_LOCAL_GUIDES, option=orjson.OPT_INDENT_2)
+SAMPLE_EMPTY_GUIDES_JSON = b"[]"
+SAMPLE_MALFORMED_GUIDES_JSON = b"{ invalid json }"
+
 SAMPLE_TRIP_REQUEST = {
     "destination": "Tokyo, Japan",
     "duration": "7 days",
@@ -41,3 +50,10 @@ SAMPLE_TRIP_REQUEST = {
     "travel_style": "standard"
 }
 
+# Read-only view for tests that never mutate the request
+SAMPLE_TRIP_REQUEST_RO = MappingProxyType(SAMPLE_TRIP_REQUEST)
+
+# Required fields only, taken from the full request so the two never drift
+SAMPLE_TRIP_REQUEST_MINIMAL = MappingProxyType(
+    {key: SAMPLE_TRIP_REQUEST[key] for key in ("destination", "duration")}
+)
@@ -1,186 +1,194 @@
 """Unit tests for agent functions."""
 
-from unittest.mock import Mock, MagicMock, patch
-from langchain_core.messages import AIMessage, SystemMessage, ToolMessage
+from contextlib import contextmanager
+
+from langchain_core.messages import SystemMessage, ToolMessage
 
 import pytest
 
-from main import research_agent, budget_agent, local_agent, itinerary_agent
+import main
+from main import (
+    BUDGET_TOOLS,
+    LOCAL_TOOLS,
+    RESEARCH_TOOLS,
+    budget_agent,
+    itinerary_agent,
+    local_agent,
+    research_agent,
+)
+
+# Shared inputs for the itinerary tests, built once per module
+LONG_TEXT = "x" * 500
+ITINERARY_INPUTS = {"research": "Research", "budget": "Budget", "local": "Local"}
+
+# Stub tool results; agents only read these, so one instance serves every test
+RESEARCH_TOOL_RESULTS = (
+    ToolMessage(content="Essential info result", tool_call_id="call_1"),
+    ToolMessage(content="Weather result", tool_call_id="call_2"),
+)
+
+
+class _FakeToolNode:
+    """Stand-in for ToolNode that returns a fixed tool result."""
+    
+    def __init__(self, messages):
+        self.result = {"messages": messages}
+    
+    def invoke(self, state):
+        return self.result
+
+
+class _FakeRetriever:
+    """Stand-in for GUIDE_RETRIEVER that returns fixed results and records calls."""
+    
+    def __init__(self, results):
+        self.results = results
+        self.calls = []
+    
+    def retrieve(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+        return self.results
+
+
+class _FakeSpan:
+    """Span stand-in that records set_attributes calls."""
+    
+    def __init__(self, recording=True):
+        self.recording = recording
+        self.attribute_calls = []
+    
+    def is_recording(self):
+        return self.recording
+    
+    def set_attributes(self, attributes):
+        self.attribute_calls.append(attributes)
+
+
+class _FakeTrace:
+    """Stand-in for opentelemetry.trace that always returns the given span."""
+    
+    def __init__(self, span):
+        self.span = span
+    
+    def get_current_span(self):
+        return self.span
 
 
 class TestResearchAgent:
     """Tests for research_agent function."""
     
-    def test_with_tool_calls(self, sample_trip_state, monkeypatch):
+    def test_with_tool_calls(self, sample_trip_state_ro, mock_llm_factory, monkeypatch):
         """Test research_agent with tool calls."""
-        # Mock LLM response with tool calls
-        mock_response = Mock()
-        mock_response.content = ""
-        mock_response.tool_calls = [
-            {"name": "essential_info", "args": {"destination": "Tokyo"}, "id": "call_1"},
-            {"name": "weather_brief", "args": {"destination": "Tokyo"}, "id": "call_2"}
-        ]
+        mock_llm = mock_llm_factory(
+            tool_calls=[
+                {"name": "essential_info", "args": {"destination": "Tokyo"}, "id": "call_1"},
+                {"name": "weather_brief", "args": {"destination": "Tokyo"}, "id": "call_2"}
+            ],
+            synthesis="Synthesized research summary",
+        )
         
-        mock_llm = Mock()
-        mock_llm.bind_tools = Mock(return_value=mock_llm)
-        mock_llm.invoke = Mock(side_effect=[
-            mock_response,  # First call returns tool calls
-            Mock(content="Synthesized research summary")  # Synthesis call
-        ])
-        
-        # Mock ToolNode
-        mock_tool_results = [
-            ToolMessage(content="Essential info result", tool_call_id="call_1"),
-            ToolMessage(content="Weather result", tool_call_id="call_2")
-        ]
+        mock_tool_node = _FakeToolNode(RESEARCH_TOOL_RESULTS)
+        monkeypatch.setattr(main, "llm", mock_llm)
+        monkeypatch.setattr(main, "ToolNode", lambda tools: mock_tool_node)
         
-        with patch('main.llm', mock_llm), \
-             patch('main.ToolNode') as mock_tool_node_class:
-            mock_tool_node = Mock()
-            mock_tool_node.invoke = Mock(return_value={"messages": mock_tool_results})
-            mock_tool_node_class.return_value = mock_tool_node
-            
-            result = research_agent(sample_trip_state)
+        result = research_agent(sample_trip_state_ro)
         
         assert "research" in result
         assert result["research"] == "Synthesized research summary"
         assert len(result["tool_calls"]) == 2
         assert result["tool_calls"][0]["agent"] == "research"
         assert result["tool_calls"][0]["tool"] == "essential_info"
+        assert mock_llm.bound_tools == RESEARCH_TOOLS
     
-    def test_without_tool_calls(self, sample_trip_state, monkeypatch):
+    def test_without_tool_calls(self, sample_trip_state_ro, mock_llm_factory, monkeypatch):
         """Test research_agent without tool calls (direct response)."""
-        mock_response = Mock()
-        mock_response.content = "Direct research response"
-        mock_response.tool_calls = []
-        
-        mock_llm = Mock()
-        mock_llm.bind_tools = Mock(return_value=mock_llm)
-        mock_llm.invoke = Mock(return_value=mock_response)
+        mock_llm = mock_llm_factory(content="Direct research response")
         
-        with patch('main.llm', mock_llm):
-            result = research_agent(sample_trip_state)
+        monkeypatch.setattr(main, "llm", mock_llm)
+        result = research_agent(sample_trip_state_ro)
         
         assert result["research"] == "Direct research response"
         assert len(result["tool_calls"]) == 0
     
-    def test_tool_selection(self, sample_trip_state, monkeypatch):
+    def test_tool_selection(self):
         """Test that research_agent uses correct tools."""
-        mock_response = Mock()
-        mock_response.content = ""
-        mock_response.tool_calls = [{"name": "essential_info", "args": {}, "id": "call_1"}]
-        
-        mock_llm = Mock()
-        mock_llm.bind_tools = Mock(return_value=mock_llm)
-        mock_llm.invoke = Mock(side_effect=[
-            mock_response,
-            Mock(content="Summary")
-        ])
-        
-        with patch('main.llm', mock_llm), \
-             patch('main.ToolNode') as mock_tool_node_class:
-            mock_tool_node = Mock()
-            mock_tool_node.invoke = Mock(return_value={"messages": []})
-            mock_tool_node_class.return_value = mock_tool_node
-            
-            # Check that bind_tools was called with correct tools
-            research_agent(sample_trip_state)
-            call_args = mock_llm.bind_tools.call_args[0][0]
-            tool_names = [tool.name for tool in call_args]
-            assert "essential_info" in tool_names
-            assert "weather_brief" in tool_names
-            assert "visa_brief" in tool_names
+        assert {tool.name for tool in RESEARCH_TOOLS} == {"essential_info", "weather_brief", "visa_brief"}
 
 
 class TestBudgetAgent:
     """Tests for budget_agent function."""
     
-    def test_with_budget_value(self, sample_trip_state, monkeypatch):
+    def test_with_budget_value(self, sample_trip_state, mock_llm_factory, monkeypatch):
         """Test budget_agent with specific budget value."""
         sample_trip_state["trip_request"]["budget"] = "$2000"
         
-        mock_response = Mock()
-        mock_response.content = ""
-        mock_response.tool_calls = [{"name": "budget_basics", "args": {}, "id": "call_1"}]
-        
-        mock_llm = Mock()
-        mock_llm.bind_tools = Mock(return_value=mock_llm)
-        mock_llm.invoke = Mock(side_effect=[
-            mock_response,
-            Mock(content="Budget breakdown for $2000")
-        ])
-        
-        with patch('main.llm', mock_llm), \
-             patch('main.ToolNode') as mock_tool_node_class:
-            mock_tool_node = Mock()
-            mock_tool_node.invoke = Mock(return_value={"messages": []})
-            mock_tool_node_class.return_value = mock_tool_node
-            
-            result = budget_agent(sample_trip_state)
+        mock_llm = mock_llm_factory(
+            tool_calls=[{"name": "budget_basics", "args": {}, "id": "call_1"}],
+            synthesis="Budget breakdown for $2000",
+        )
+        
+        mock_tool_node = _FakeToolNode([])
+        monkeypatch.setattr(main, "llm", mock_llm)
+        monkeypatch.setattr(main, "ToolNode", lambda tools: mock_tool_node)
+        
+        result = budget_agent(sample_trip_state)
         
         assert "budget" in result
         assert "$2000" in result["budget"] or "2000" in result["budget"]
-        assert len(result["tool_calls"]) >= 0
+        assert len(result["tool_calls"]) == 1
+        assert result["tool_calls"][0]["tool"] == "budget_basics"
+        assert mock_llm.bound_tools == BUDGET_TOOLS
     
-    def test_with_default_budget(self, sample_trip_state, monkeypatch):
-        """Test budget_agent defaults to 'moderate' when budget not specified."""
-        sample_trip_state["trip_request"].pop("budget", None)
-        
-        mock_response = Mock()
-        mock_response.content = "Budget analysis"
-        mock_response.tool_calls = []
-        
-        mock_llm = Mock()
-        mock_llm.bind_tools = Mock(return_value=mock_llm)
-        mock_llm.invoke = Mock(return_value=mock_response)
-        
-        with patch('main.llm', mock_llm):
-            result = budget_agent(sample_trip_state)
+    @pytest.mark.parametrize("budget,expected", [
+        ("$2000", "$2000"),
+        (None, "moderate"),
+    ], ids=["explicit", "default"])
+    def test_budget_in_prompt(self, sample_trip_state, mock_llm_factory, monkeypatch, budget, expected):
+        """Test budget_agent uses the requested budget, defaulting to 'moderate'."""
+        if budget is None:
+            sample_trip_state["trip_request"].pop("budget", None)
+        else:
+            sample_trip_state["trip_request"]["budget"] = budget
+        
+        mock_llm = mock_llm_factory(content="Budget analysis")
+        
+        monkeypatch.setattr(main, "llm", mock_llm)
+        result = budget_agent(sample_trip_state)
         
         assert result["budget"] == "Budget analysis"
+        assert expected in mock_llm.calls[-1][-1].content
     
-    def test_tool_selection(self, sample_trip_state, monkeypatch):
+    def test_tool_selection(self):
         """Test that budget_agent uses correct tools."""
-        mock_response = Mock()
-        mock_response.content = ""
-        mock_response.tool_calls = []
-        
-        mock_llm = Mock()
-        mock_llm.bind_tools = Mock(return_value=mock_llm)
-        mock_llm.invoke = Mock(return_value=mock_response)
-        
-        with patch('main.llm', mock_llm):
-            budget_agent(sample_trip_state)
-            call_args = mock_llm.bind_tools.call_args[0][0]
-            tool_names = [tool.name for tool in call_args]
-            assert "budget_basics" in tool_names
-            assert "attraction_prices" in tool_names
+        assert {tool.name for tool in BUDGET_TOOLS} == {"budget_basics", "attraction_prices"}
 
 
 class TestLocalAgent:
     """Tests for local_agent function."""
     
-    def test_with_rag_disabled(self, sample_trip_state, monkeypatch):
-        """Test local_agent when RAG is disabled."""
-        import main
+    @pytest.mark.parametrize("overrides,expected", [
+        ({}, "Local experiences"),
+        ({"interests": "art, architecture"}, "Art-focused experiences"),
+        ({"travel_style": "luxury"}, "Luxury experiences"),
+    ], ids=["rag_disabled", "interests", "travel_style"])
+    def test_variants_with_rag_disabled(self, sample_trip_state, mock_llm_factory, monkeypatch, overrides, expected):
+        """Test local_agent passes interests/travel style to the LLM when RAG is disabled."""
         monkeypatch.setattr(main, "ENABLE_RAG", False)
         
-        mock_response = Mock()
-        mock_response.content = "Local experiences"
-        mock_response.tool_calls = []
+        sample_trip_state["trip_request"].update(overrides)
         
-        mock_llm = Mock()
-        mock_llm.bind_tools = Mock(return_value=mock_llm)
-        mock_llm.invoke = Mock(return_value=mock_response)
+        mock_llm = mock_llm_factory(content=expected)
         
-        with patch('main.llm', mock_llm):
-            result = local_agent(sample_trip_state)
+        monkeypatch.setattr(main, "llm", mock_llm)
+        result = local_agent(sample_trip_state)
         
-        assert result["local"] == "Local experiences"
+        assert result["local"] == expected
+        prompt_content = mock_llm.calls[-1][-1].content
+        for value in overrides.values():
+            assert value in prompt_content
     
-    def test_with_rag_enabled(self, sample_trip_state, monkeypatch):
+    def test_with_rag_enabled(self, sample_trip_state_ro, mock_llm_factory, monkeypatch):
         """Test local_agent when RAG is enabled and returns results."""
-        import main
         monkeypatch.setattr(main, "ENABLE_RAG", True)
         
         mock_retrieved = [
@@ -190,220 +198,169 @@ class TestLocalAgent:
             }
         ]
         
-        mock_response = Mock()
-        mock_response.content = "Local experiences"
-        mock_response.tool_calls = []
+        mock_llm = mock_llm_factory(content="Local experiences")
         
-        mock_llm = Mock()
-        mock_llm.bind_tools = Mock(return_value=mock_llm)
-        mock_llm.invoke = Mock(return_value=mock_response)
+        fake_retriever = _FakeRetriever(mock_retrieved)
+        monkeypatch.setattr(main, "llm", mock_llm)
+        monkeypatch.setattr(main, "GUIDE_RETRIEVER", fake_retriever)
         
-        with patch('main.llm', mock_llm), \
-             patch('main.GUIDE_RETRIEVER') as mock_retriever:
-            mock_retriever.retrieve = Mock(return_value=mock_retrieved)
-            
-            result = local_agent(sample_trip_state)
+        result = local_agent(sample_trip_state_ro)
         
         # Verify retriever was called
-        mock_retriever.retrieve.assert_called_once()
+        assert len(fake_retriever.calls) == 1
         assert result["local"] == "Local experiences"
+        assert mock_llm.bound_tools == LOCAL_TOOLS
     
-    def test_with_interests(self, sample_trip_state, monkeypatch):
-        """Test local_agent with specific interests."""
-        import main
-        monkeypatch.setattr(main, "ENABLE_RAG", False)
-        
-        sample_trip_state["trip_request"]["interests"] = "art, architecture"
-        
-        mock_response = Mock()
-        mock_response.content = "Art-focused experiences"
-        mock_response.tool_calls = []
-        
-        mock_llm = Mock()
-        mock_llm.bind_tools = Mock(return_value=mock_llm)
-        mock_llm.invoke = Mock(return_value=mock_response)
-        
-        with patch('main.llm', mock_llm):
-            result = local_agent(sample_trip_state)
-        
-        assert result["local"] == "Art-focused experiences"
-    
-    def test_with_travel_style(self, sample_trip_state, monkeypatch):
-        """Test local_agent with specific travel style."""
-        import main
-        monkeypatch.setattr(main, "ENABLE_RAG", False)
-        
-        sample_trip_state["trip_request"]["travel_style"] = "luxury"
-        
-        mock_response = Mock()
-        mock_response.content = "Luxury experiences"
-        mock_response.tool_calls = []
-        
-        mock_llm = Mock()
-        mock_llm.bind_tools = Mock(return_value=mock_llm)
-        mock_llm.invoke = Mock(return_value=mock_response)
-        
-        with patch('main.llm', mock_llm):
-            result = local_agent(sample_trip_state)
-        
-        assert result["local"] == "Luxury experiences"
-    
-    def test_tool_selection(self, sample_trip_state, monkeypatch):
+    def test_tool_selection(self):
         """Test that local_agent uses correct tools."""
-        import main
-        monkeypatch.setattr(main, "ENABLE_RAG", False)
-        
-        mock_response = Mock()
-        mock_response.content = ""
-        mock_response.tool_calls = []
-        
-        mock_llm = Mock()
-        mock_llm.bind_tools = Mock(return_value=mock_llm)
-        mock_llm.invoke = Mock(return_value=mock_response)
-        
-        with patch('main.llm', mock_llm):
-            local_agent(sample_trip_state)
-            call_args = mock_llm.bind_tools.call_args[0][0]
-            tool_names = [tool.name for tool in call_args]
-            assert "local_flavor" in tool_names
-            assert "local_customs" in tool_names
-            assert "hidden_gems" in tool_names
+        assert {tool.name for tool in LOCAL_TOOLS} == {"local_flavor", "local_customs", "hidden_gems"}
 
 
 class TestItineraryAgent:
     """Tests for itinerary_agent function."""
     
-    def test_synthesis_with_all_inputs(self, sample_trip_state, monkeypatch):
+    def test_synthesis_with_all_inputs(self, sample_trip_state, mock_llm_factory, monkeypatch):
         """Test itinerary_agent synthesizes research, budget, and local inputs."""
         sample_trip_state["research"] = "Research summary"
         sample_trip_state["budget"] = "Budget summary"
         sample_trip_state["local"] = "Local summary"
         
-        mock_response = Mock()
-        mock_response.content = "Complete itinerary"
+        mock_llm = mock_llm_factory(content="Complete itinerary")
         
-        mock_llm = Mock()
-        mock_llm.invoke = Mock(return_value=mock_response)
-        
-        with patch('main.llm', mock_llm):
-            result = itinerary_agent(sample_trip_state)
+        monkeypatch.setattr(main, "llm", mock_llm)
+        result = itinerary_agent(sample_trip_state)
         
         assert result["final"] == "Complete itinerary"
         # Verify LLM was called with all inputs
-        call_args = mock_llm.invoke.call_args[0][0]
-        prompt_content = call_args[0].content
+        prompt_content = mock_llm.calls[-1][-1].content
         assert "Research summary" in prompt_content
         assert "Budget summary" in prompt_content
         assert "Local summary" in prompt_content
     
-    def test_truncates_long_inputs(self, sample_trip_state, monkeypatch):
+    def test_truncates_long_inputs(self, sample_trip_state, mock_llm_factory, monkeypatch):
         """Test that itinerary_agent truncates inputs to 400 characters."""
-        long_text = "x" * 500
-        sample_trip_state["research"] = long_text
-        sample_trip_state["budget"] = long_text
-        sample_trip_state["local"] = long_text
-        
-        mock_response = Mock()
-        mock_response.content = "Itinerary"
-        
-        mock_llm = Mock()
-        mock_llm.invoke = Mock(return_value=mock_response)
-        
-        with patch('main.llm', mock_llm):
-            result = itinerary_agent(sample_trip_state)
-        
-        # Verify truncation happened - check that inputs in prompt are max 400 chars
-        call_args = mock_llm.invoke.call_args[0][0]
-        prompt_content = call_args[0].content
-        
-        # Extract the research, budget, and local lines
-        lines = prompt_content.split("\n")
-        research_line = next((l for l in lines if l.startswith("Research:")), None)
-        budget_line = next((l for l in lines if l.startswith("Budget:")), None)
-        local_line = next((l for l in lines if l.startswith("Local:")), None)
-        
-        # Each should be truncated to 400 chars (plus prefix)
-        if research_line:
-            assert len(research_line.replace("Research: ", "")) <= 400
-        if budget_line:
-            assert len(budget_line.replace("Budget: ", "")) <= 400
-        if local_line:
-            assert len(local_line.replace("Local: ", "")) <= 400
-    
-    def test_with_user_input(self, sample_trip_state, monkeypatch):
-        """Test itinerary_agent includes user_input when provided."""
-        sample_trip_state["trip_request"]["user_input"] = "I prefer morning activities"
-        sample_trip_state["research"] = "Research"
-        sample_trip_state["budget"] = "Budget"
-        sample_trip_state["local"] = "Local"
-        
-        mock_response = Mock()
-        mock_response.content = "Itinerary with user preferences"
+        sample_trip_state["research"] = LONG_TEXT
+        sample_trip_state["budget"] = LONG_TEXT
+        sample_trip_state["local"] = LONG_TEXT
         
-        mock_llm = Mock()
-        mock_llm.invoke = Mock(return_value=mock_response)
+        mock_llm = mock_llm_factory(content="Itinerary")
         
-        with patch('main.llm', mock_llm):
-            result = itinerary_agent(sample_trip_state)
+        monkeypatch.setattr(main, "llm", mock_llm)
+        itinerary_agent(sample_trip_state)
         
-        call_args = mock_llm.invoke.call_args[0][0]
-        prompt_content = call_args[0].content
-        assert "I prefer morning activities" in prompt_content
+        # Each input line must be present and cut to exactly its first 400 characters
+        lines = mock_llm.calls[-1][-1].content.split("\n")
+        for label in ("Research", "Budget", "Local"):
+            assert f"{label}: {'x' * 400}" in lines
     
-    def test_without_user_input(self, sample_trip_state, monkeypatch):
-        """Test itinerary_agent works without user_input."""
+    @pytest.mark.parametrize("overrides,present,absent", [
+        ({"user_input": "I prefer morning activities"}, "I prefer morning activities", None),
+        ({}, None, "User input:"),
+        ({"travel_style": "budget"}, "(budget)", None),
+    ], ids=["user_input", "no_user_input", "travel_style"])
+    def test_prompt_variants(self, sample_trip_state, mock_llm_factory, monkeypatch, overrides, present, absent):
+        """Test itinerary_agent includes user_input and travel_style in the prompt."""
         sample_trip_state["trip_request"].pop("user_input", None)
-        sample_trip_state["research"] = "Research"
-        sample_trip_state["budget"] = "Budget"
-        sample_trip_state["local"] = "Local"
+        sample_trip_state["trip_request"].update(overrides)
+        sample_trip_state.update(ITINERARY_INPUTS)
         
-        mock_response = Mock()
-        mock_response.content = "Itinerary"
+        mock_llm = mock_llm_factory(content="Itinerary")
         
-        mock_llm = Mock()
-        mock_llm.invoke = Mock(return_value=mock_response)
+        monkeypatch.setattr(main, "llm", mock_llm)
+        result = itinerary_agent(sample_trip_state)
         
-        with patch('main.llm', mock_llm):
-            result = itinerary_agent(sample_trip_state)
-        
-        call_args = mock_llm.invoke.call_args[0][0]
-        prompt_content = call_args[0].content
-        assert "User input:" not in prompt_content
+        assert result["final"] == "Itinerary"
+        prompt_content = mock_llm.calls[-1][-1].content
+        if present:
+            assert present in prompt_content
+        if absent:
+            assert absent not in prompt_content
     
-    def test_with_travel_style(self, sample_trip_state, monkeypatch):
-        """Test itinerary_agent includes travel_style."""
-        sample_trip_state["trip_request"]["travel_style"] = "budget"
-        sample_trip_state["research"] = "Research"
-        sample_trip_state["budget"] = "Budget"
-        sample_trip_state["local"] = "Local"
-        
-        mock_response = Mock()
-        mock_response.content = "Budget itinerary"
-        
-        mock_llm = Mock()
-        mock_llm.invoke = Mock(return_value=mock_response)
-        
-        with patch('main.llm', mock_llm):
-            result = itinerary_agent(sample_trip_state)
-        
-        call_args = mock_llm.invoke.call_args[0][0]
-        prompt_content = call_args[0].content
-        assert "budget" in prompt_content.lower()
+    def test_static_system_prefix(self, sample_trip_state, mock_llm_factory, monkeypatch):
+        """Test the system prompt is identical across requests and request details stay in the human message."""
+        mock_llm = mock_llm_factory(content="Itinerary")
+        
+        monkeypatch.setattr(main, "llm", mock_llm)
+        itinerary_agent(sample_trip_state)
+        first = mock_llm.calls[-1]
+        sample_trip_state["trip_request"]["destination"] = "Lisbon, Portugal"
+        itinerary_agent(sample_trip_state)
+        second = mock_llm.calls[-1]
+        
+        assert isinstance(first[0], SystemMessage)
+        assert first[0].content == second[0].content
+        assert "Lisbon" not in second[0].content
+        assert "Lisbon" in second[-1].content
     
-    def test_handles_missing_inputs(self, sample_trip_state, monkeypatch):
+    def test_handles_missing_inputs(self, sample_trip_state, mock_llm_factory, monkeypatch):
         """Test itinerary_agent handles missing research/budget/local inputs."""
         sample_trip_state.pop("research", None)
         sample_trip_state.pop("budget", None)
         sample_trip_state.pop("local", None)
         
-        mock_response = Mock()
-        mock_response.content = "Itinerary"
+        mock_llm = mock_llm_factory(content="Itinerary")
         
-        mock_llm = Mock()
-        mock_llm.invoke = Mock(return_value=mock_response)
-        
-        with patch('main.llm', mock_llm):
-            result = itinerary_agent(sample_trip_state)
+        monkeypatch.setattr(main, "llm", mock_llm)
+        result = itinerary_agent(sample_trip_state)
         
         assert result["final"] == "Itinerary"
 
+
+class TestSpanAttributes:
+    """Tests for agent span metadata."""
+    
+    @pytest.fixture
+    def span(self, monkeypatch):
+        """Recording span stand-in installed as the current span, with tracing on."""
+        span = _FakeSpan()
+        monkeypatch.setattr(main, "_TRACING", True)
+        monkeypatch.setattr(main, "trace", _FakeTrace(span), raising=False)
+        return span
+    
+    def test_attributes_set_in_one_call(self, span, sample_trip_state_ro, mock_llm_factory, monkeypatch):
+        """Test agent metadata reaches the span as a single set_attributes mapping."""
+        monkeypatch.setattr(main, "llm", mock_llm_factory(content="Research"))
+        
+        research_agent(sample_trip_state_ro)
+        
+        assert span.attribute_calls == [
+            {"metadata.agent_type": "research", "metadata.agent_node": "research_agent"},
+        ]
+    
+    def test_skipped_when_span_not_recording(self, span, sample_trip_state_ro, mock_llm_factory, monkeypatch):
+        """Test no span metadata is built for a span that is not recording."""
+        span.recording = False
+        monkeypatch.setattr(main, "llm", mock_llm_factory(content="Itinerary"))
+        
+        itinerary_agent(sample_trip_state_ro)
+        
+        assert span.attribute_calls == []
+
+
+class TestPromptTemplates:
+    """Tests for the prompt templates recorded for tracing."""
+    
+    @pytest.mark.parametrize("agent,system_prompt", [
+        (research_agent, main.RESEARCH_SYSTEM_PROMPT),
+        (budget_agent, main.BUDGET_SYSTEM_PROMPT),
+        (local_agent, main.LOCAL_SYSTEM_PROMPT),
+        (itinerary_agent, main.ITINERARY_SYSTEM_PROMPT),
+    ], ids=["research", "budget", "local", "itinerary"])
+    def test_template_includes_instructions(self, sample_trip_state_ro, mock_llm_factory, monkeypatch, agent, system_prompt):
+        """Test the recorded template carries the agent's instructions as well as its variables."""
+        recorded = []
+        
+        @contextmanager
+        def record_template(**kwargs):
+            recorded.append(kwargs)
+            yield
+        
+        monkeypatch.setattr(main, "ENABLE_RAG", False)
+        monkeypatch.setattr(main, "using_prompt_template", record_template)
+        monkeypatch.setattr(main, "llm", mock_llm_factory(content="Done"))
+        
+        agent(sample_trip_state_ro)
+        
+        template = recorded[0]["template"]
+        assert template.startswith(system_prompt + "\n\n")
+        assert "{destination}" in template
@@ -1,10 +1,16 @@
 """Integration tests for FastAPI endpoints."""
 
-from unittest.mock import Mock, patch
+import asyncio
+import json
+import re
+import time
+from contextlib import contextmanager
+from types import MappingProxyType
 
 import pytest
-
-from main import TripRequest, TripResponse
+from fastapi.testclient import TestClient
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessageChunk
 
 
 class TestHealthEndpoint:
@@ -14,9 +20,22 @@ class TestHealthEndpoint:
         """Test health endpoint returns correct response."""
         response = test_client.get("/health")
         assert response.status_code == 200
-        data = response.json()
-        assert data["status"] == "healthy"
-        assert data["service"] == "ai-trip-planner"
+        assert response.content == b'{"status":"healthy","service":"ai-trip-planner"}'
+
+
+class TestLifespan:
+    """Tests for application startup/shutdown hooks."""
+    
+    def test_shared_http_client_lifecycle(self, main_module):
+        """Test lifespan opens the shared search client and closes it on shutdown."""
+        
+        with TestClient(main_module.app):
+            client = main_module._HTTP_CLIENT
+            assert client is not None
+            assert not client.is_closed
+        
+        assert client.is_closed
+        assert main_module._HTTP_CLIENT is None
 
 
 class TestFrontendEndpoint:
@@ -34,23 +53,79 @@ class TestFrontendEndpoint:
             assert "message" in data
 
 
+    def test_frontend_missing_message(self, main_module, test_client, monkeypatch):
+        """Test a JSON message is returned when the UI file is absent."""
+        monkeypatch.setattr(main_module, "FRONTEND_EXISTS", False)
+        response = test_client.get("/")
+        assert response.status_code == 200
+        assert response.json() == {"message": "frontend/index.html not found"}
+
+
+class _InvokeGraph:
+    """Graph stand-in whose ainvoke awaits nothing and returns the given function's result."""
+    
+    __slots__ = ("fn",)
+    
+    def __init__(self, fn):
+        self.fn = fn
+    
+    async def ainvoke(self, state):
+        return self.fn(state)
+
+
+def _graph_returning(output):
+    """Graph stand-in that ignores its input and returns a fresh copy of ``output``."""
+    return _InvokeGraph(lambda state: dict(output))
+
+
+# Graph outputs reused across endpoint tests, built once per module
+MINIMAL_OUTPUT = MappingProxyType({"final": "Test itinerary", "tool_calls": []})
+FULL_OUTPUT = MappingProxyType({
+    "final": "Complete itinerary",
+    "tool_calls": [{"agent": "research", "tool": "essential_info", "args": {}}],
+})
+TWO_TOOL_OUTPUT = MappingProxyType({
+    "final": "Itinerary",
+    "tool_calls": [
+        {"agent": "research", "tool": "weather_brief", "args": {"destination": "Tokyo"}},
+        {"agent": "budget", "tool": "budget_basics", "args": {"destination": "Tokyo", "duration": "7 days"}},
+    ],
+})
+ITINERARY_OUTPUT = MappingProxyType({"final": "Itinerary", "tool_calls": []})
+NO_TOOL_OUTPUT = MappingProxyType({"final": "Itinerary without tools", "tool_calls": []})
+NO_FINAL_OUTPUT = MappingProxyType({"tool_calls": []})
+
+
+class _LoopCheckingCache:
+    """SemanticResponseCache stand-in that records whether each call ran on an event loop."""
+    
+    def __init__(self):
+        self.on_loop = []
+    
+    def _record(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.on_loop.append(False)
+        else:
+            self.on_loop.append(True)
+    
+    def lookup(self, req):
+        self._record()
+        return None
+    
+    def store(self, req, response):
+        self._record()
+
+
+@pytest.mark.asyncio
 class TestPlanTripEndpoint:
     """Tests for POST /plan-trip endpoint."""
     
-    def test_with_minimal_fields(self, test_client, sample_trip_request_minimal):
+    async def test_with_minimal_fields(self, main_module, async_client, sample_trip_request_minimal, monkeypatch):
         """Test plan_trip with only required fields."""
-        def mock_graph_invoke(state):
-            return {
-                "final": "Test itinerary",
-                "tool_calls": []
-            }
-        
-        with patch('main.build_graph') as mock_build:
-            mock_graph = Mock()
-            mock_graph.invoke = Mock(side_effect=mock_graph_invoke)
-            mock_build.return_value = mock_graph
-            
-            response = test_client.post("/plan-trip", json=sample_trip_request_minimal)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: _graph_returning(MINIMAL_OUTPUT))
+        response = await async_client.post("/plan-trip", json=sample_trip_request_minimal)
         
         assert response.status_code == 200
         data = response.json()
@@ -58,77 +133,38 @@ class TestPlanTripEndpoint:
         assert "tool_calls" in data
         assert data["result"] == "Test itinerary"
     
-    def test_with_all_fields(self, test_client, sample_trip_request):
+    async def test_with_all_fields(self, main_module, async_client, sample_trip_request, monkeypatch):
         """Test plan_trip with all optional fields."""
-        sample_trip_request["session_id"] = "test-session-123"
-        sample_trip_request["user_id"] = "user-456"
-        sample_trip_request["turn_index"] = 1
-        
-        def mock_graph_invoke(state):
-            return {
-                "final": "Complete itinerary",
-                "tool_calls": [
-                    {"agent": "research", "tool": "essential_info", "args": {}}
-                ]
-            }
+        payload = {
+            **sample_trip_request,
+            "session_id": "test-session-123",
+            "user_id": "user-456",
+            "turn_index": 1,
+        }
         
-        with patch('main.build_graph') as mock_build:
-            mock_graph = Mock()
-            mock_graph.invoke = Mock(side_effect=mock_graph_invoke)
-            mock_build.return_value = mock_graph
-            
-            response = test_client.post("/plan-trip", json=sample_trip_request)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: _graph_returning(FULL_OUTPUT))
+        response = await async_client.post("/plan-trip", json=payload)
         
         assert response.status_code == 200
         data = response.json()
         assert data["result"] == "Complete itinerary"
         assert len(data["tool_calls"]) == 1
     
-    def test_missing_destination(self, test_client):
-        """Test plan_trip validation error for missing destination."""
-        invalid_request = {
-            "duration": "7 days"
-        }
-        
-        response = test_client.post("/plan-trip", json=invalid_request)
+    @pytest.mark.parametrize("payload", [
+        {},
+        {"duration": "7 days"},
+        {"destination": "Tokyo"},
+        {"destination": 123, "duration": "7 days"},  # Should be string
+    ], ids=["empty", "missing_destination", "missing_duration", "invalid_type"])
+    async def test_validation_error(self, async_client, payload):
+        """Test plan_trip rejects missing or mistyped required fields."""
+        response = await async_client.post("/plan-trip", json=payload)
         assert response.status_code == 422  # Validation error
     
-    def test_missing_duration(self, test_client):
-        """Test plan_trip validation error for missing duration."""
-        invalid_request = {
-            "destination": "Tokyo"
-        }
-        
-        response = test_client.post("/plan-trip", json=invalid_request)
-        assert response.status_code == 422  # Validation error
-    
-    def test_invalid_request_type(self, test_client):
-        """Test plan_trip with invalid data types."""
-        invalid_request = {
-            "destination": 123,  # Should be string
-            "duration": "7 days"
-        }
-        
-        response = test_client.post("/plan-trip", json=invalid_request)
-        assert response.status_code == 422  # Validation error
-    
-    def test_response_structure(self, test_client, sample_trip_request_minimal):
+    async def test_response_structure(self, main_module, async_client, sample_trip_request_minimal, monkeypatch):
         """Test that response matches TripResponse model."""
-        def mock_graph_invoke(state):
-            return {
-                "final": "Itinerary",
-                "tool_calls": [
-                    {"agent": "research", "tool": "weather_brief", "args": {"destination": "Tokyo"}},
-                    {"agent": "budget", "tool": "budget_basics", "args": {"destination": "Tokyo", "duration": "7 days"}}
-                ]
-            }
-        
-        with patch('main.build_graph') as mock_build:
-            mock_graph = Mock()
-            mock_graph.invoke = Mock(side_effect=mock_graph_invoke)
-            mock_build.return_value = mock_graph
-            
-            response = test_client.post("/plan-trip", json=sample_trip_request_minimal)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: _graph_returning(TWO_TOOL_OUTPUT))
+        response = await async_client.post("/plan-trip", json=sample_trip_request_minimal)
         
         assert response.status_code == 200
         data = response.json()
@@ -140,44 +176,25 @@ class TestPlanTripEndpoint:
         assert isinstance(data["tool_calls"], list)
         assert len(data["tool_calls"]) == 2
     
-    def test_empty_tool_calls(self, test_client, sample_trip_request_minimal):
+    async def test_empty_tool_calls(self, main_module, async_client, sample_trip_request_minimal, monkeypatch):
         """Test response when no tool calls are made."""
-        def mock_graph_invoke(state):
-            return {
-                "final": "Itinerary without tools",
-                "tool_calls": []
-            }
-        
-        with patch('main.build_graph') as mock_build:
-            mock_graph = Mock()
-            mock_graph.invoke = Mock(side_effect=mock_graph_invoke)
-            mock_build.return_value = mock_graph
-            
-            response = test_client.post("/plan-trip", json=sample_trip_request_minimal)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: _graph_returning(NO_TOOL_OUTPUT))
+        response = await async_client.post("/plan-trip", json=sample_trip_request_minimal)
         
         assert response.status_code == 200
         data = response.json()
         assert data["tool_calls"] == []
     
-    def test_missing_final_in_state(self, test_client, sample_trip_request_minimal):
+    async def test_missing_final_in_state(self, main_module, async_client, sample_trip_request_minimal, monkeypatch):
         """Test handling when final is missing from graph state."""
-        def mock_graph_invoke(state):
-            return {
-                "tool_calls": []
-            }
-        
-        with patch('main.build_graph') as mock_build:
-            mock_graph = Mock()
-            mock_graph.invoke = Mock(side_effect=mock_graph_invoke)
-            mock_build.return_value = mock_graph
-            
-            response = test_client.post("/plan-trip", json=sample_trip_request_minimal)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: _graph_returning(NO_FINAL_OUTPUT))
+        response = await async_client.post("/plan-trip", json=sample_trip_request_minimal)
         
         assert response.status_code == 200
         data = response.json()
         assert data["result"] == ""  # Empty string when missing
     
-    def test_with_optional_fields_none(self, test_client):
+    async def test_with_optional_fields_none(self, main_module, async_client, monkeypatch):
         """Test plan_trip with None values for optional fields."""
         request = {
             "destination": "Tokyo",
@@ -187,22 +204,12 @@ class TestPlanTripEndpoint:
             "travel_style": None
         }
         
-        def mock_graph_invoke(state):
-            return {
-                "final": "Itinerary",
-                "tool_calls": []
-            }
-        
-        with patch('main.build_graph') as mock_build:
-            mock_graph = Mock()
-            mock_graph.invoke = Mock(side_effect=mock_graph_invoke)
-            mock_build.return_value = mock_graph
-            
-            response = test_client.post("/plan-trip", json=request)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: _graph_returning(ITINERARY_OUTPUT))
+        response = await async_client.post("/plan-trip", json=request)
         
         assert response.status_code == 200
     
-    def test_state_construction(self, test_client, sample_trip_request):
+    async def test_state_construction(self, main_module, async_client, sample_trip_request, monkeypatch):
         """Test that state is constructed correctly from request."""
         captured_state = {}
         
@@ -214,12 +221,8 @@ class TestPlanTripEndpoint:
                 "tool_calls": []
             }
         
-        with patch('main.build_graph') as mock_build:
-            mock_graph = Mock()
-            mock_graph.invoke = Mock(side_effect=mock_graph_invoke)
-            mock_build.return_value = mock_graph
-            
-            test_client.post("/plan-trip", json=sample_trip_request)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: _InvokeGraph(mock_graph_invoke))
+        await async_client.post("/plan-trip", json=sample_trip_request)
         
         # Verify state structure
         assert "messages" in captured_state
@@ -231,7 +234,7 @@ class TestPlanTripEndpoint:
         assert trip_req["destination"] == sample_trip_request["destination"]
         assert trip_req["duration"] == sample_trip_request["duration"]
     
-    def test_graph_invocation(self, test_client, sample_trip_request_minimal):
+    async def test_graph_invocation(self, main_module, async_client, sample_trip_request_minimal, monkeypatch):
         """Test that graph is invoked correctly."""
         graph_invoked = False
         
@@ -243,13 +246,423 @@ class TestPlanTripEndpoint:
                 "tool_calls": []
             }
         
-        with patch('main.build_graph') as mock_build:
-            mock_graph = Mock()
-            mock_graph.invoke = Mock(side_effect=mock_graph_invoke)
-            mock_build.return_value = mock_graph
-            
-            test_client.post("/plan-trip", json=sample_trip_request_minimal)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: _InvokeGraph(mock_graph_invoke))
+        await async_client.post("/plan-trip", json=sample_trip_request_minimal)
         
         assert graph_invoked
-        assert mock_build.called
 
+    
+    async def test_repeat_request_served_from_cache(self, main_module, async_client, sample_trip_request_minimal, monkeypatch):
+        """Test identical requests reuse the cached itinerary instead of re-running the graph."""
+        invocations = []
+        
+        def mock_graph_invoke(state):
+            invocations.append(state)
+            return {
+                "final": "Cached itinerary",
+                "tool_calls": []
+            }
+        
+        monkeypatch.setattr(main_module, "_get_graph", lambda: _InvokeGraph(mock_graph_invoke))
+        first = await async_client.post("/plan-trip", json=sample_trip_request_minimal)
+        second = await async_client.post("/plan-trip", json=sample_trip_request_minimal)
+        
+        assert first.content == second.content
+        assert len(invocations) == 1
+    
+    async def test_semantic_cache_runs_off_the_event_loop(self, main_module, async_client, sample_trip_request_minimal, monkeypatch):
+        """Test the blocking semantic-cache lookup and store never run on the loop thread."""
+        cache = _LoopCheckingCache()
+        monkeypatch.setattr(main_module, "SEMANTIC_CACHE", cache)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: _graph_returning(MINIMAL_OUTPUT))
+        await async_client.post("/plan-trip", json=sample_trip_request_minimal)
+        
+        assert cache.on_loop == [False, False]
+    
+    async def test_empty_result_not_cached(self, main_module, async_client, sample_trip_request_minimal, monkeypatch):
+        """Test that empty itineraries are not memoized."""
+        invocations = []
+        
+        def mock_graph_invoke(state):
+            invocations.append(state)
+            return {"tool_calls": []}
+        
+        monkeypatch.setattr(main_module, "_get_graph", lambda: _InvokeGraph(mock_graph_invoke))
+        await async_client.post("/plan-trip", json=sample_trip_request_minimal)
+        await async_client.post("/plan-trip", json=sample_trip_request_minimal)
+        
+        assert len(invocations) == 2
+
+
+class TestResponseCache:
+    """Tests for the ResponseCache helper."""
+    
+    def test_key_ignores_case_and_whitespace(self, main_module):
+        """Test cache keys are normalized across trivial formatting differences."""
+        a = main_module.TripRequest.model_construct(destination="Tokyo, Japan", duration="7 days")
+        b = main_module.TripRequest.model_construct(destination=" tokyo, japan ", duration="7 Days")
+        assert main_module.ResponseCache.key_for(a) == main_module.ResponseCache.key_for(b)
+    
+    def test_evicts_least_recently_used(self, main_module):
+        """Test the cache never grows past maxsize."""
+        cache = main_module.ResponseCache(maxsize=2, ttl=60)
+        cache.set(b"a", 1)
+        cache.set(b"b", 2)
+        cache.get(b"a")
+        cache.set(b"c", 3)
+        assert cache.get(b"a") == 1
+        assert cache.get(b"b") is None
+        assert cache.get(b"c") == 3
+    
+    def test_expired_entries_are_dropped(self, main_module, monkeypatch):
+        """Test entries past their TTL are treated as misses."""
+        cache = main_module.ResponseCache(maxsize=2, ttl=60)
+        cache.set(b"a", 1)
+        later = time.monotonic() + 120
+        monkeypatch.setattr(main_module.time, "monotonic", lambda: later)
+        assert cache.get(b"a") is None
+
+
+class _KeywordEmbedding(Embeddings):
+    """Bag-of-words embedding over a small vocabulary, so similarity is predictable.
+    
+    Word order, punctuation and words outside VOCAB are ignored: "food and wine"
+    and "wine & food" embed identically, while a different city or interest
+    lowers the cosine similarity.
+    """
+    
+    VOCAB = ("paris", "lima", "oslo", "rome", "food", "wine", "art")
+    
+    def _embed(self, text):
+        words = re.findall(r"[a-z]+", text.lower())
+        return [float(words.count(term)) + 0.01 for term in self.VOCAB]
+    
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+    
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class TestSemanticResponseCache:
+    """Tests for the SemanticResponseCache helper."""
+    
+    @pytest.fixture
+    def semantic_cache(self, main_module):
+        """SemanticResponseCache backed by keyword embeddings with controlled similarity."""
+        from langchain_core.vectorstores import InMemoryVectorStore
+        
+        cache = main_module.SemanticResponseCache(threshold=0.95, maxsize=2, ttl=60)
+        cache._vectorstore = InMemoryVectorStore(embedding=_KeywordEmbedding())
+        return cache
+    
+    @staticmethod
+    def _paris(main_module, **overrides):
+        fields = {"destination": "Paris, France", "duration": "3 days", "interests": "food and wine", **overrides}
+        return main_module.TripRequest.model_construct(**fields)
+    
+    def test_disabled_in_test_mode(self, main_module):
+        """Test that no vectorstore is created in TEST_MODE."""
+        cache = main_module.SemanticResponseCache()
+        assert cache._vectorstore is None
+        assert cache.lookup(main_module.TripRequest.model_construct(destination="Tokyo", duration="7 days")) is None
+    
+    def test_paraphrase_hits(self, main_module, semantic_cache):
+        """Test a reworded destination and interests reuse the stored itinerary."""
+        response = main_module.TripResponse(result="Paris itinerary")
+        semantic_cache.store(self._paris(main_module), response)
+        paraphrase = self._paris(main_module, destination="paris", interests="Wine & food", duration=" 3 Days")
+        assert semantic_cache.lookup(paraphrase) == response
+    
+    @pytest.mark.parametrize("overrides", [
+        {"duration": "10 days"},
+        {"budget": "luxury"},
+        {"travel_style": "budget"},
+    ], ids=["duration", "budget", "travel_style"])
+    def test_exact_fields_must_match(self, main_module, semantic_cache, overrides):
+        """Test a near-identical request for a different length, budget or style misses."""
+        semantic_cache.store(self._paris(main_module), main_module.TripResponse(result="Paris"))
+        assert semantic_cache.lookup(self._paris(main_module, **overrides)) is None
+    
+    def test_misses_below_threshold(self, main_module, semantic_cache):
+        """Test dissimilar requests do not reuse a stored response."""
+        semantic_cache.store(self._paris(main_module), main_module.TripResponse(result="Paris"))
+        assert semantic_cache.lookup(self._paris(main_module, interests="art")) is None
+        assert semantic_cache.lookup(self._paris(main_module, destination="Lima")) is None
+    
+    def test_expired_entry_does_not_shadow_fresh_one(self, main_module, semantic_cache, monkeypatch):
+        """Test an expired nearest neighbour is purged and a fresh, less similar entry still hits."""
+        clock = [100.0]
+        monkeypatch.setattr(main_module.time, "monotonic", lambda: clock[0])
+        semantic_cache.threshold = 0.8
+        semantic_cache.store(self._paris(main_module), main_module.TripResponse(result="old"))
+        clock[0] += 50
+        semantic_cache.store(self._paris(main_module, interests="food, wine and art"), main_module.TripResponse(result="new"))
+        clock[0] += 20  # Only the first entry has expired
+        
+        assert semantic_cache.lookup(self._paris(main_module)).result == "new"
+        assert len(semantic_cache._vectorstore.store) == 1
+    
+    def test_restore_replaces_document(self, main_module, semantic_cache):
+        """Test storing the same request twice keeps one document and the latest response."""
+        semantic_cache.store(self._paris(main_module), main_module.TripResponse(result="first"))
+        semantic_cache.store(self._paris(main_module, destination="PARIS,  france"), main_module.TripResponse(result="second"))
+        
+        assert len(semantic_cache._vectorstore.store) == 1
+        assert semantic_cache.lookup(self._paris(main_module)).result == "second"
+    
+    def test_skips_requests_with_user_input(self, main_module, semantic_cache):
+        """Test requests with free-form user input bypass the semantic cache."""
+        req = self._paris(main_module, user_input="no museums")
+        semantic_cache.store(req, main_module.TripResponse(result="Paris"))
+        assert semantic_cache.lookup(req) is None
+    
+    def test_evicts_oldest_entries(self, main_module, semantic_cache):
+        """Test the cache stays within maxsize."""
+        requests = [self._paris(main_module, destination=city) for city in ("Paris", "Rome", "Oslo")]
+        for req in requests:
+            semantic_cache.store(req, main_module.TripResponse(result=req.destination))
+        assert semantic_cache.lookup(requests[0]) is None
+        assert semantic_cache.lookup(requests[2]).result == "Oslo"
+        assert len(semantic_cache._vectorstore.store) == 2
+
+
+def _sse_events(response):
+    """Decode the JSON payloads of a Server-Sent Events response body."""
+    return [
+        json.loads(line[len("data: "):])
+        for line in response.text.splitlines()
+        if line.startswith("data: ")
+    ]
+
+
+class _StreamingGraph:
+    """Graph stand-in whose astream replays a fixed list of (mode, chunk) pairs.
+    
+    With ``fail_after`` set, it raises once that many chunks have been yielded.
+    """
+    
+    def __init__(self, chunks, fail_after=None):
+        self.chunks = chunks
+        self.fail_after = fail_after
+        self.calls = 0
+    
+    async def astream(self, state, stream_mode=None):
+        self.calls += 1
+        for n, chunk in enumerate(self.chunks):
+            if n == self.fail_after:
+                raise RuntimeError("LLM unavailable")
+            yield chunk
+
+
+class TestPlanTripStreamEndpoint:
+    """Tests for POST /plan-trip-stream endpoint."""
+    
+    STREAM = [
+        ("updates", {"research_node": {"research": "R", "tool_calls": [{"agent": "research", "tool": "essential_info", "args": {}}]}}),
+        ("messages", (AIMessageChunk(content="ignored"), {"langgraph_node": "budget_node"})),
+        ("updates", {"budget_node": {"budget": "B", "tool_calls": []}}),
+        ("updates", {"local_node": {"local": "L", "tool_calls": []}}),
+        ("messages", (AIMessageChunk(content="Day 1: "), {"langgraph_node": "itinerary_node"})),
+        ("messages", (AIMessageChunk(content="Sushi"), {"langgraph_node": "itinerary_node"})),
+        ("updates", {"itinerary_node": {"final": "Day 1: Sushi"}}),
+    ]
+    
+    def test_streams_agent_progress_and_itinerary(self, main_module, test_client, sample_trip_request_minimal, monkeypatch):
+        """Test the stream emits agent events, itinerary deltas, then the final result."""
+        # Only the size threshold may flush, so both deltas coalesce however slow the run
+        monkeypatch.setattr(main_module, "STREAM_FLUSH_INTERVAL", float("inf"))
+        graph = _StreamingGraph(self.STREAM)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: graph)
+        response = test_client.post("/plan-trip-stream", json=sample_trip_request_minimal)
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = _sse_events(response)
+        assert [e["agent"] for e in events if "agent" in e] == ["research", "budget", "local"]
+        assert [e["content"] for e in events if "content" in e] == ["Day 1: Sushi"]
+        assert events[-1]["result"] == "Day 1: Sushi"
+        assert len(events[-1]["tool_calls"]) == 1
+    
+    def test_flushes_large_deltas_immediately(self, main_module, test_client, sample_trip_request_minimal, monkeypatch):
+        """Test buffered deltas are flushed once they reach STREAM_FLUSH_CHARS."""
+        monkeypatch.setattr(main_module, "STREAM_FLUSH_CHARS", 5)
+        graph = _StreamingGraph(self.STREAM)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: graph)
+        response = test_client.post("/plan-trip-stream", json=sample_trip_request_minimal)
+        
+        events = _sse_events(response)
+        assert [e["content"] for e in events if "content" in e] == ["Day 1: ", "Sushi"]
+    
+    def test_replays_cached_itinerary(self, main_module, test_client, sample_trip_request_minimal, monkeypatch):
+        """Test a cached itinerary is replayed without re-running the graph."""
+        graph = _StreamingGraph(self.STREAM)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: graph)
+        test_client.post("/plan-trip-stream", json=sample_trip_request_minimal)
+        response = test_client.post("/plan-trip-stream", json=sample_trip_request_minimal)
+        
+        events = _sse_events(response)
+        assert graph.calls == 1
+        assert events[0] == {"content": "Day 1: Sushi"}
+        assert events[-1]["result"] == "Day 1: Sushi"
+    
+    def test_failure_midway_ends_with_error_event(self, main_module, test_client, sample_trip_request_minimal, monkeypatch):
+        """Test a graph error after streaming starts yields a terminal error event and caches nothing."""
+        graph = _StreamingGraph(self.STREAM, fail_after=2)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: graph)
+        response = test_client.post("/plan-trip-stream", json=sample_trip_request_minimal)
+        
+        assert response.status_code == 200
+        events = _sse_events(response)
+        assert events[0]["agent"] == "research"
+        assert events[-1] == {"error": "Trip planning failed (RuntimeError)"}
+        assert not any("result" in e for e in events)
+        
+        test_client.post("/plan-trip-stream", json=sample_trip_request_minimal)
+        assert graph.calls == 2
+    
+    def test_semantic_cache_runs_off_the_event_loop(self, main_module, test_client, sample_trip_request_minimal, monkeypatch):
+        """Test the stream's cache lookup and store never run on the loop thread."""
+        cache = _LoopCheckingCache()
+        monkeypatch.setattr(main_module, "SEMANTIC_CACHE", cache)
+        graph = _StreamingGraph(self.STREAM)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: graph)
+        test_client.post("/plan-trip-stream", json=sample_trip_request_minimal)
+        
+        assert cache.on_loop == [False, False]
+    
+    def test_endpoint_exists(self, main_module, test_client, sample_trip_request_minimal, monkeypatch):
+        """Test the endpoint answers with an event stream, reading only the first event."""
+        graph = _StreamingGraph(self.STREAM)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: graph)
+        with test_client.stream("POST", "/plan-trip-stream", json=sample_trip_request_minimal) as response:
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/event-stream")
+            first = next(line for line in response.iter_lines() if line)
+        
+        assert json.loads(first[len("data: "):])["agent"] == "research"
+    
+    def test_validation_error(self, test_client):
+        """Test the stream endpoint validates the request body."""
+        response = test_client.post("/plan-trip-stream", json={"destination": "Tokyo"})
+        assert response.status_code == 422
+
+
+class _BatchGraph:
+    """Graph stand-in whose ainvoke maps each state through a function and records it."""
+    
+    def __init__(self, fn):
+        self.fn = fn
+        self.states = []
+    
+    async def ainvoke(self, state):
+        self.states.append(state)
+        return self.fn(state)
+
+
+class TestPlanTripsEndpoint:
+    """Tests for POST /plan-trips batch endpoint."""
+    
+    @staticmethod
+    def _itinerary_for(state):
+        return {"final": f"Trip to {state['trip_request']['destination']}", "tool_calls": []}
+    
+    def test_returns_results_in_request_order(self, main_module, test_client, monkeypatch):
+        """Test each trip's itinerary is returned at its request position."""
+        graph = _BatchGraph(self._itinerary_for)
+        payload = [
+            {"destination": "Tokyo", "duration": "3 days"},
+            {"destination": "Paris", "duration": "5 days"},
+        ]
+        monkeypatch.setattr(main_module, "_get_graph", lambda: graph)
+        response = test_client.post("/plan-trips", json=payload)
+        
+        assert response.status_code == 200
+        assert [r["result"] for r in response.json()] == ["Trip to Tokyo", "Trip to Paris"]
+        assert len(graph.states) == 2
+    
+    def test_cached_trips_skip_the_graph(self, main_module, test_client, monkeypatch):
+        """Test only cache misses are sent to the graph."""
+        graph = _BatchGraph(self._itinerary_for)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: graph)
+        test_client.post("/plan-trips", json=[{"destination": "Tokyo", "duration": "3 days"}])
+        response = test_client.post("/plan-trips", json=[
+            {"destination": "Tokyo", "duration": "3 days"},
+            {"destination": "Rome", "duration": "2 days"},
+        ])
+        
+        assert [r["result"] for r in response.json()] == ["Trip to Tokyo", "Trip to Rome"]
+        assert len(graph.states) == 2
+        assert graph.states[-1]["trip_request"]["destination"] == "Rome"
+    
+    def test_semantic_cache_runs_off_the_event_loop(self, main_module, test_client, monkeypatch):
+        """Test batch cache lookups and stores never run on the loop thread."""
+        cache = _LoopCheckingCache()
+        monkeypatch.setattr(main_module, "SEMANTIC_CACHE", cache)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: _BatchGraph(self._itinerary_for))
+        test_client.post("/plan-trips", json=[{"destination": "Oslo", "duration": "2 days"}])
+        
+        assert cache.on_loop == [False, False]
+    
+    def test_duplicate_trips_share_one_run(self, main_module, test_client, monkeypatch):
+        """Test identical trips in one batch run the graph once and all get the result."""
+        graph = _BatchGraph(self._itinerary_for)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: graph)
+        payload = [
+            {"destination": "Lima", "duration": "4 days"},
+            {"destination": "Quito", "duration": "2 days"},
+            {"destination": " lima ", "duration": "4 Days"},
+        ]
+        response = test_client.post("/plan-trips", json=payload)
+        
+        assert [r["result"] for r in response.json()] == ["Trip to Lima", "Trip to Quito", "Trip to Lima"]
+        assert len(graph.states) == 2
+    
+    def test_failed_trip_does_not_sink_the_batch(self, main_module, test_client, monkeypatch):
+        """Test one failing graph run is reported in its slot while the other trips succeed."""
+        def itinerary_or_fail(state):
+            if state["trip_request"]["destination"] == "Nowhere":
+                raise RuntimeError("LLM unavailable")
+            return self._itinerary_for(state)
+        
+        graph = _BatchGraph(itinerary_or_fail)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: graph)
+        payload = [
+            {"destination": "Hanoi", "duration": "3 days"},
+            {"destination": "Nowhere", "duration": "3 days"},
+        ]
+        response = test_client.post("/plan-trips", json=payload)
+        
+        assert response.status_code == 200
+        ok, failed = response.json()
+        assert ok["result"] == "Trip to Hanoi" and ok["error"] is None
+        assert failed["result"] == "" and failed["error"] == "Trip planning failed (RuntimeError)"
+        
+        # The successful trip was cached; the failed one is retried
+        test_client.post("/plan-trips", json=payload)
+        assert [s["trip_request"]["destination"] for s in graph.states] == ["Hanoi", "Nowhere", "Nowhere"]
+    
+    def test_each_trip_gets_its_tracing_attributes(self, main_module, test_client, monkeypatch):
+        """Test every graph run is wrapped in its own request's tracing attributes."""
+        seen = []
+        
+        @contextmanager
+        def record_attributes(req):
+            seen.append((req.session_id, req.user_id))
+            yield
+        
+        monkeypatch.setattr(main_module, "_request_attributes", record_attributes)
+        monkeypatch.setattr(main_module, "_get_graph", lambda: _BatchGraph(self._itinerary_for))
+        test_client.post("/plan-trips", json=[
+            {"destination": "Kyoto", "duration": "3 days", "session_id": "s1", "user_id": "u1"},
+            {"destination": "Seoul", "duration": "3 days", "session_id": "s2", "user_id": "u2"},
+        ])
+        
+        assert sorted(seen) == [("s1", "u1"), ("s2", "u2")]
+    
+    def test_rejects_oversized_batch(self, main_module, test_client, monkeypatch):
+        """Test batches over MAX_BATCH_TRIPS are rejected."""
+        monkeypatch.setattr(main_module, "MAX_BATCH_TRIPS", 1)
+        payload = [{"destination": "Tokyo", "duration": "3 days"}] * 2
+        response = test_client.post("/plan-trips", json=payload)
+        assert response.status_code == 422
@@ -1,16 +1,32 @@
 """Unit tests for LocalGuideRetriever and _load_local_documents."""
 
-import json
-import os
-from pathlib import Path
-from unittest.mock import Mock, MagicMock, patch
-
 import pytest
 from langchain_core.documents import Document
 
-from main import LocalGuideRetriever, _load_local_documents
+from main import LocalGuideRetriever, _guides_to_documents, _load_local_documents
 from tests.fixtures.sample_data import SAMPLE_LOCAL_GUIDES
 
+VECTOR_DOC = Document(
+    page_content="City: Tokyo\nInterests: food\nGuide: Test guide",
+    metadata={"city": "Tokyo", "interests": ["food"], "score": 0.95}
+)
+
+
+class _FakeVectorStore:
+    """Stand-in vectorstore whose retriever returns fixed docs or raises."""
+    
+    def __init__(self, docs=(), error=None):
+        self.docs = list(docs)
+        self.error = error
+    
+    def as_retriever(self, **kwargs):
+        if self.error:
+            raise self.error
+        return self
+    
+    def invoke(self, query):
+        return self.docs
+
 
 class TestLoadLocalDocuments:
     """Tests for _load_local_documents helper function."""
@@ -36,17 +52,16 @@ class TestLoadLocalDocuments:
         docs = _load_local_documents(temp_empty_guides_file)
         assert docs == []
     
-    def test_filters_invalid_entries(self, tmp_path):
+    def test_filters_invalid_entries(self):
         """Test that entries without city or description are filtered out."""
         invalid_data = [
             {"city": "Tokyo"},  # Missing description
             {"description": "A guide"},  # Missing city
             {"city": "Paris", "description": "Valid guide"},  # Valid
         ]
-        guides_file = tmp_path / "guides.json"
-        guides_file.write_text(json.dumps(invalid_data))
         
-        docs = _load_local_documents(guides_file)
+        # Row filtering lives in _guides_to_documents, so no file is needed
+        docs = _guides_to_documents(invalid_data)
         assert len(docs) == 1
         assert docs[0].metadata["city"] == "Paris"
     
@@ -63,13 +78,9 @@ class TestLoadLocalDocuments:
         assert "City:" in doc.page_content
         assert "Guide:" in doc.page_content
     
-    def test_handles_missing_interests(self, tmp_path):
+    def test_handles_missing_interests(self):
         """Test handling of entries without interests field."""
-        data = [{"city": "Tokyo", "description": "A guide"}]
-        guides_file = tmp_path / "guides.json"
-        guides_file.write_text(json.dumps(data))
-        
-        docs = _load_local_documents(guides_file)
+        docs = _guides_to_documents([{"city": "Tokyo", "description": "A guide"}])
         assert len(docs) == 1
         assert docs[0].metadata.get("interests") == []
 
@@ -99,6 +110,13 @@ class TestLocalGuideRetrieverInitialization:
         retriever = LocalGuideRetriever(temp_local_guides_file)
         assert retriever._vectorstore is None
         assert retriever._embeddings is None
+    
+    def test_from_iterable_matches_file(self, temp_local_guides_file):
+        """Test from_iterable indexes the same documents as loading the file."""
+        from_file = LocalGuideRetriever(temp_local_guides_file)
+        from_rows = LocalGuideRetriever.from_iterable(SAMPLE_LOCAL_GUIDES)
+        assert from_rows._docs == from_file._docs
+        assert from_rows._vectorstore is None
 
 
 class TestIsEmptyProperty:
@@ -115,40 +133,39 @@ class TestIsEmptyProperty:
         assert not retriever.is_empty
 
 
+@pytest.mark.usefixtures("rag_enabled")
 class TestRetrieveMethod:
     """Tests for retrieve method."""
     
-    def test_returns_empty_when_rag_disabled(self, temp_local_guides_file, monkeypatch):
+    def test_returns_empty_when_rag_disabled(self, main_module, mock_retriever_with_data, monkeypatch):
         """Test retrieve returns empty list when RAG is disabled."""
-        import main
-        monkeypatch.setattr(main, "ENABLE_RAG", False)
-        # Need to create new retriever after patching ENABLE_RAG
-        retriever = LocalGuideRetriever(temp_local_guides_file)
+        monkeypatch.setattr(main_module, "ENABLE_RAG", False)
+        # retrieve() reads ENABLE_RAG per call, so a prebuilt retriever works
+        retriever = mock_retriever_with_data
         results = retriever.retrieve("Tokyo", None)
         assert results == []
     
-    def test_returns_empty_when_empty(self, temp_empty_guides_file, monkeypatch):
+    def test_returns_empty_when_empty(self, mock_retriever_empty):
         """Test retrieve returns empty list when retriever is empty."""
-        monkeypatch.setenv("ENABLE_RAG", "1")
-        retriever = LocalGuideRetriever(temp_empty_guides_file)
+        retriever = mock_retriever_empty
         results = retriever.retrieve("Tokyo", None)
         assert results == []
     
-    def test_keyword_fallback_matches_city(self, temp_local_guides_file, monkeypatch):
-        """Test keyword fallback matches city names."""
-        monkeypatch.setenv("ENABLE_RAG", "1")
-        retriever = LocalGuideRetriever(temp_local_guides_file)
-        results = retriever.retrieve("Tokyo", None, k=5)
-        
-        # Should return Tokyo entries
-        assert len(results) > 0
-        assert all("Tokyo" in r["content"] or r["metadata"]["city"] == "Tokyo" 
-                  for r in results)
+    @pytest.mark.parametrize("destination,interests,k,expected_cities", [
+        ("Tokyo", None, 5, ["Tokyo", "Tokyo"]),
+        ("Tokyo, Japan", None, 5, ["Tokyo", "Tokyo"]),
+        ("Tokyo", None, 1, ["Tokyo"]),
+        ("NonexistentCity", None, 5, []),
+        ("Tokyo", "food, culture", 5, ["Tokyo", "New York", "Tokyo", "Paris"]),
+    ], ids=["city", "partial_city", "respects_k", "no_match", "comma_separated_interests"])
+    def test_keyword_fallback_matches(self, mock_retriever_with_data, destination, interests, k, expected_cities):
+        """Test keyword fallback returns the expected guides for each query."""
+        results = mock_retriever_with_data.retrieve(destination, interests, k=k)
+        assert [r["metadata"]["city"] for r in results] == expected_cities
     
-    def test_keyword_fallback_filters_by_interests(self, temp_local_guides_file, monkeypatch):
+    def test_keyword_fallback_filters_by_interests(self, mock_retriever_with_data):
         """Test keyword fallback filters by interests."""
-        monkeypatch.setenv("ENABLE_RAG", "1")
-        retriever = LocalGuideRetriever(temp_local_guides_file)
+        retriever = mock_retriever_with_data
         results = retriever.retrieve("Tokyo", "food", k=5)
         
         # Should prioritize entries with food interest
@@ -158,24 +175,9 @@ class TestRetrieveMethod:
                        any("food" in str(i).lower() for i in r["metadata"].get("interests", []))]
         assert len(food_results) > 0
     
-    def test_keyword_fallback_respects_k_parameter(self, temp_local_guides_file, monkeypatch):
-        """Test that k parameter limits results."""
-        monkeypatch.setenv("ENABLE_RAG", "1")
-        retriever = LocalGuideRetriever(temp_local_guides_file)
-        results = retriever.retrieve("Tokyo", None, k=2)
-        assert len(results) <= 2
-    
-    def test_keyword_fallback_returns_empty_for_no_match(self, temp_local_guides_file, monkeypatch):
-        """Test keyword fallback returns empty for non-matching destination."""
-        monkeypatch.setenv("ENABLE_RAG", "1")
-        retriever = LocalGuideRetriever(temp_local_guides_file)
-        results = retriever.retrieve("NonexistentCity", None, k=5)
-        assert results == []
-    
-    def test_keyword_fallback_scores_correctly(self, temp_local_guides_file, monkeypatch):
+    def test_keyword_fallback_scores_correctly(self, mock_retriever_with_data):
         """Test keyword fallback scoring logic."""
-        monkeypatch.setenv("ENABLE_RAG", "1")
-        retriever = LocalGuideRetriever(temp_local_guides_file)
+        retriever = mock_retriever_with_data
         results = retriever.retrieve("Tokyo", "food", k=5)
         
         # Results should be sorted by score (descending)
@@ -186,58 +188,21 @@ class TestRetrieveMethod:
         # All results should have score > 0
         assert all(r["score"] > 0 for r in results)
     
-    def test_keyword_fallback_handles_comma_separated_interests(self, temp_local_guides_file, monkeypatch):
-        """Test keyword fallback handles comma-separated interests."""
-        monkeypatch.setenv("ENABLE_RAG", "1")
-        retriever = LocalGuideRetriever(temp_local_guides_file)
-        results = retriever.retrieve("Tokyo", "food, culture", k=5)
-        
-        assert len(results) > 0
-        # Should match entries with either food or culture
-    
-    def test_keyword_fallback_handles_partial_city_match(self, temp_local_guides_file, monkeypatch):
-        """Test keyword fallback handles partial city name matches."""
-        monkeypatch.setenv("ENABLE_RAG", "1")
-        retriever = LocalGuideRetriever(temp_local_guides_file)
-        # Test with "Tokyo, Japan" should match "Tokyo"
-        results = retriever.retrieve("Tokyo, Japan", None, k=5)
-        assert len(results) > 0
-    
-    def test_vector_search_path_when_available(self, temp_local_guides_file, monkeypatch):
+    def test_vector_search_path_when_available(self, mock_retriever_fresh):
         """Test vector search path when vectorstore is available."""
-        import main
-        monkeypatch.setattr(main, "ENABLE_RAG", True)
-        
-        # Mock vectorstore
-        mock_vectorstore = MagicMock()
-        mock_doc = Document(
-            page_content="City: Tokyo\nInterests: food\nGuide: Test guide",
-            metadata={"city": "Tokyo", "interests": ["food"], "score": 0.95}
-        )
-        mock_retriever = MagicMock()
-        mock_retriever.invoke = Mock(return_value=[mock_doc])
-        mock_vectorstore.as_retriever = Mock(return_value=mock_retriever)
-        
-        retriever = LocalGuideRetriever(temp_local_guides_file)
-        retriever._vectorstore = mock_vectorstore
+        retriever = mock_retriever_fresh
+        retriever._vectorstore = _FakeVectorStore([VECTOR_DOC])
         
         results = retriever.retrieve("Tokyo", "food", k=3)
         
         assert len(results) > 0
-        assert results[0]["content"] == mock_doc.page_content
+        assert results[0]["content"] == VECTOR_DOC.page_content
         assert results[0]["score"] == 0.95
     
-    def test_falls_back_to_keywords_on_vector_error(self, temp_local_guides_file, monkeypatch):
+    def test_falls_back_to_keywords_on_vector_error(self, mock_retriever_fresh):
         """Test that vector search errors fall back to keyword search."""
-        import main
-        monkeypatch.setattr(main, "ENABLE_RAG", True)
-        
-        # Mock vectorstore that raises exception
-        mock_vectorstore = MagicMock()
-        mock_vectorstore.as_retriever = Mock(side_effect=Exception("Vector search failed"))
-        
-        retriever = LocalGuideRetriever(temp_local_guides_file)
-        retriever._vectorstore = mock_vectorstore
+        retriever = mock_retriever_fresh
+        retriever._vectorstore = _FakeVectorStore(error=Exception("Vector search failed"))
         
         results = retriever.retrieve("Tokyo", None, k=3)
         
@@ -246,13 +211,13 @@ class TestRetrieveMethod:
         # May be empty if no matches, but should not raise exception
 
 
+@pytest.mark.usefixtures("rag_enabled")
 class TestKeywordFallbackScoring:
     """Tests for _keyword_fallback scoring logic."""
     
-    def test_city_match_scores_higher(self, temp_local_guides_file, monkeypatch):
+    def test_city_match_scores_higher(self, mock_retriever_with_data):
         """Test that city matches score higher than non-matches."""
-        monkeypatch.setenv("ENABLE_RAG", "1")
-        retriever = LocalGuideRetriever(temp_local_guides_file)
+        retriever = mock_retriever_with_data
         
         tokyo_results = retriever.retrieve("Tokyo", None, k=10)
         paris_results = retriever.retrieve("Paris", None, k=10)
@@ -265,19 +230,32 @@ class TestKeywordFallbackScoring:
         if paris_results:
             assert any("Paris" in r["metadata"]["city"] for r in paris_results)
     
-    def test_interest_matching_adds_to_score(self, temp_local_guides_file, monkeypatch):
+    def test_interest_matching_adds_to_score(self, mock_retriever_with_data):
         """Test that matching interests increases score."""
-        monkeypatch.setenv("ENABLE_RAG", "1")
-        retriever = LocalGuideRetriever(temp_local_guides_file)
+        retriever = mock_retriever_with_data
         
         # Get results with and without interests
         results_with_interests = retriever.retrieve("Tokyo", "food", k=10)
         results_without_interests = retriever.retrieve("Tokyo", None, k=10)
         
+        # Matching interests raise the top score above the city-only score
+        assert results_with_interests[0]["score"] > results_without_interests[0]["score"]
+        
         # Results with matching interests should be prioritized
         if results_with_interests:
             # Top results should have food-related content
             top_result = results_with_interests[0]
             assert ("food" in top_result["content"].lower() or 
                    any("food" in str(i).lower() for i in top_result["metadata"].get("interests", [])))
-
+    
+    def test_exact_scores(self, mock_retriever_with_data):
+        """Test city matches add 2 and each interest hit in metadata or content adds 1."""
+        results = mock_retriever_with_data.retrieve("Tokyo, Japan", "food", k=10)
+        
+        # Ties keep corpus order
+        assert [(r["score"], r["metadata"]["source"]) for r in results] == [
+            (4.0, "https://example.com/tokyo-guide"),
+            (2.0, "https://example.com/tokyo-art"),
+            (2.0, "https://example.com/paris-food"),
+            (2.0, "https://example.com/nyc-food"),
+        ]
@@ -1,7 +1,11 @@
 """Unit tests for tool functions."""
 
+import threading
+import time
+
+import httpx
+import orjson
 import pytest
-from unittest.mock import patch, MagicMock
 
 from main import (
     essential_info,
@@ -19,6 +23,38 @@ from main import (
     _compact
 )
 
+# Every tool must degrade to the LLM when search returns nothing
+FALLBACK_CASES = [
+    (essential_info, {"destination": "Tokyo"}),
+    (budget_basics, {"destination": "Paris", "duration": "5 days"}),
+    (local_flavor, {"destination": "Tokyo", "interests": "art"}),
+    (day_plan, {"destination": "Tokyo", "day": 2}),
+    (weather_brief, {"destination": "Paris"}),
+    (visa_brief, {"destination": "Paris"}),
+    (attraction_prices, {"destination": "Tokyo", "attractions": ["Museum"]}),
+    (local_customs, {"destination": "Paris"}),
+    (hidden_gems, {"destination": "Paris"}),
+    (travel_time, {"from_location": "A", "to_location": "B", "mode": "car"}),
+    (packing_list, {"destination": "Tokyo", "duration": "7 days", "activities": ["sightseeing"]}),
+]
+
+# Canned search API bodies, serialized once and served by the mock transport
+TAVILY_BODY = orjson.dumps({
+    "answer": "Tokyo is best in spring.",
+    "results": [{"content": "Cherry blossoms peak in April."}, {"snippet": "Book early."}],
+})
+SERPAPI_BODY = orjson.dumps({
+    "organic_results": [{"snippet": "Visit Senso-ji early."}, {"snippet": "Try Tsukiji."}],
+})
+
+# Single-argument tools label search results with "<destination> <topic>"
+PREFIX_CASES = [
+    (weather_brief, "Tokyo weather"),
+    (visa_brief, "Tokyo visa"),
+    (local_customs, "Tokyo customs"),
+    (hidden_gems, "Tokyo hidden gems"),
+]
+
 
 class TestEssentialInfo:
     """Tests for essential_info tool."""
@@ -29,11 +65,6 @@ class TestEssentialInfo:
         assert "Tokyo essentials" in result
         assert len(result) > 0
     
-    def test_with_search_api_failure(self, mock_search_api_failure, mock_llm_fallback):
-        """Test essential_info falls back to LLM when search API fails."""
-        result = essential_info.invoke({"destination": "Tokyo"})
-        assert "LLM fallback" in result or len(result) > 0
-    
     def test_query_construction(self, mock_search_api_success):
         """Test that query includes expected terms."""
         essential_info.invoke({"destination": "Paris"})
@@ -49,11 +80,6 @@ class TestBudgetBasics:
         result = budget_basics.invoke({"destination": "Tokyo", "duration": "7 days"})
         assert "Tokyo budget" in result
         assert "7 days" in result
-    
-    def test_fallback_behavior(self, mock_search_api_failure, mock_llm_fallback):
-        """Test budget_basics falls back to LLM."""
-        result = budget_basics.invoke({"destination": "Paris", "duration": "5 days"})
-        assert len(result) > 0
 
 
 class TestLocalFlavor:
@@ -69,11 +95,6 @@ class TestLocalFlavor:
         """Test local_flavor defaults to 'local culture' when interests not provided."""
         result = local_flavor.invoke({"destination": "Paris"})
         assert "Paris" in result
-    
-    def test_fallback_behavior(self, mock_search_api_failure, mock_llm_fallback):
-        """Test local_flavor falls back to LLM."""
-        result = local_flavor.invoke({"destination": "Tokyo", "interests": "art"})
-        assert len(result) > 0
 
 
 class TestDayPlan:
@@ -91,39 +112,6 @@ class TestDayPlan:
         result2 = day_plan.invoke({"destination": "Paris", "day": 3})
         assert "Day 1" in result1
         assert "Day 3" in result2
-    
-    def test_fallback_behavior(self, mock_search_api_failure, mock_llm_fallback):
-        """Test day_plan falls back to LLM."""
-        result = day_plan.invoke({"destination": "Tokyo", "day": 2})
-        assert len(result) > 0
-
-
-class TestWeatherBrief:
-    """Tests for weather_brief tool."""
-    
-    def test_basic_functionality(self, mock_search_api_success):
-        """Test weather_brief returns formatted result."""
-        result = weather_brief.invoke({"destination": "Tokyo"})
-        assert "Tokyo weather" in result
-    
-    def test_fallback_behavior(self, mock_search_api_failure, mock_llm_fallback):
-        """Test weather_brief falls back to LLM."""
-        result = weather_brief.invoke({"destination": "Paris"})
-        assert len(result) > 0
-
-
-class TestVisaBrief:
-    """Tests for visa_brief tool."""
-    
-    def test_basic_functionality(self, mock_search_api_success):
-        """Test visa_brief returns formatted result."""
-        result = visa_brief.invoke({"destination": "Tokyo"})
-        assert "Tokyo visa" in result
-    
-    def test_fallback_behavior(self, mock_search_api_failure, mock_llm_fallback):
-        """Test visa_brief falls back to LLM."""
-        result = visa_brief.invoke({"destination": "Paris"})
-        assert len(result) > 0
 
 
 class TestAttractionPrices:
@@ -138,39 +126,6 @@ class TestAttractionPrices:
         """Test attraction_prices defaults to 'popular attractions'."""
         result = attraction_prices.invoke({"destination": "Paris"})
         assert "Paris" in result
-    
-    def test_fallback_behavior(self, mock_search_api_failure, mock_llm_fallback):
-        """Test attraction_prices falls back to LLM."""
-        result = attraction_prices.invoke({"destination": "Tokyo", "attractions": ["Museum"]})
-        assert len(result) > 0
-
-
-class TestLocalCustoms:
-    """Tests for local_customs tool."""
-    
-    def test_basic_functionality(self, mock_search_api_success):
-        """Test local_customs returns formatted result."""
-        result = local_customs.invoke({"destination": "Tokyo"})
-        assert "Tokyo customs" in result
-    
-    def test_fallback_behavior(self, mock_search_api_failure, mock_llm_fallback):
-        """Test local_customs falls back to LLM."""
-        result = local_customs.invoke({"destination": "Paris"})
-        assert len(result) > 0
-
-
-class TestHiddenGems:
-    """Tests for hidden_gems tool."""
-    
-    def test_basic_functionality(self, mock_search_api_success):
-        """Test hidden_gems returns formatted result."""
-        result = hidden_gems.invoke({"destination": "Tokyo"})
-        assert "Tokyo hidden gems" in result
-    
-    def test_fallback_behavior(self, mock_search_api_failure, mock_llm_fallback):
-        """Test hidden_gems falls back to LLM."""
-        result = hidden_gems.invoke({"destination": "Paris"})
-        assert len(result) > 0
 
 
 class TestTravelTime:
@@ -187,11 +142,6 @@ class TestTravelTime:
         result = travel_time.invoke({"from_location": "Paris", "to_location": "Lyon", "mode": "train"})
         assert "Paris" in result
         assert "Lyon" in result
-    
-    def test_fallback_behavior(self, mock_search_api_failure, mock_llm_fallback):
-        """Test travel_time falls back to LLM."""
-        result = travel_time.invoke({"from_location": "A", "to_location": "B", "mode": "car"})
-        assert len(result) > 0
 
 
 class TestPackingList:
@@ -206,11 +156,26 @@ class TestPackingList:
         """Test packing_list defaults to 'sightseeing'."""
         result = packing_list.invoke({"destination": "Paris", "duration": "5 days"})
         assert "Paris" in result
-    
-    def test_fallback_behavior(self, mock_search_api_failure, mock_llm_fallback):
-        """Test packing_list falls back to LLM."""
-        result = packing_list.invoke({"destination": "Tokyo", "duration": "7 days", "activities": ["sightseeing"]})
-        assert len(result) > 0
+
+
+class TestSearchSummaries:
+    """Tests for single-argument tools when search returns results."""
+    
+    @pytest.mark.parametrize("tool,expected", PREFIX_CASES, ids=[t.name for t, _ in PREFIX_CASES])
+    def test_prefixes_search_result(self, tool, expected, mock_search_api_success):
+        """Test the tool labels the search summary with destination and topic."""
+        result = tool.invoke({"destination": "Tokyo"})
+        assert expected in result
+
+
+class TestToolFallbacks:
+    """Tests for the LLM fallback shared by every tool."""
+    
+    @pytest.mark.parametrize("tool,kwargs", FALLBACK_CASES, ids=[t.name for t, _ in FALLBACK_CASES])
+    def test_falls_back_to_llm(self, tool, kwargs, mock_search_api_failure, mock_llm_fallback):
+        """Test the tool returns the LLM fallback when search fails."""
+        result = tool.invoke(kwargs)
+        assert result.startswith("LLM fallback response")
 
 
 class TestHelperFunctions:
@@ -239,7 +204,259 @@ class TestHelperFunctions:
         result = _compact(short_text, limit=200)
         assert result == short_text
     
+    def test_compact_collapses_long_whitespace_runs(self):
+        """Test _compact truncates correctly when whitespace runs exceed the limit."""
+        text = " " * 1000 + "word\n\n" * 100
+        assert _compact(text, limit=50) == " ".join(["word"] * 10)
+        assert _compact("a" + " " * 500 + "b", limit=50) == "a b"
+    
     def test_compact_handles_empty(self):
         """Test _compact handles empty strings."""
         assert _compact("") == ""
+    
+    def test_rate_limiter_uses_configured_rate(self, main_module, monkeypatch):
+        """Test the LLM rate limiter follows LLM_REQUESTS_PER_SECOND."""
+        monkeypatch.setenv("LLM_REQUESTS_PER_SECOND", "2")
+        limiter = main_module._init_rate_limiter()
+        assert limiter.requests_per_second == 2
+    
+    def test_rate_limiter_split_across_workers(self, main_module, monkeypatch):
+        """Test the LLM budget is shared by all WEB_CONCURRENCY workers."""
+        monkeypatch.setenv("LLM_REQUESTS_PER_SECOND", "8")
+        monkeypatch.setenv("WEB_CONCURRENCY", "4")
+        limiter = main_module._init_rate_limiter()
+        assert limiter.requests_per_second == 2
+    
+    def test_rate_limiter_disabled_with_zero(self, main_module, monkeypatch):
+        """Test LLM_REQUESTS_PER_SECOND=0 disables rate limiting."""
+        monkeypatch.setenv("LLM_REQUESTS_PER_SECOND", "0")
+        assert main_module._init_rate_limiter() is None
+    
+    def test_http_client_created_once_under_concurrency(self, main_module, monkeypatch):
+        """Test threads racing for the shared search client all get the same instance."""
+        created = []
+        
+        class SlowClient(httpx.Client):
+            def __init__(self, *args, **kwargs):
+                time.sleep(0.01)  # Widen the window between the None check and assignment
+                super().__init__(*args, **kwargs)
+                created.append(self)
+        
+        monkeypatch.setattr(main_module, "_HTTP_CLIENT", None)
+        monkeypatch.setattr(main_module.httpx, "Client", SlowClient)
+        seen = []
+        threads = [threading.Thread(target=lambda: seen.append(main_module._http_client())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for client in created:
+            client.close()
+        
+        assert len(created) == 1
+        assert all(client is created[0] for client in seen)
+    
+    def test_llm_requires_api_key(self, main_module, monkeypatch):
+        """Test _init_llm refuses to start without an API key outside TEST_MODE."""
+        for key in ("TEST_MODE", "OPENAI_API_KEY", "OPENROUTER_API_KEY"):
+            monkeypatch.delenv(key, raising=False)
+        with pytest.raises(ValueError, match="OPENAI_API_KEY or OPENROUTER_API_KEY"):
+            main_module._init_llm()
+
+
+class TestSearchApi:
+    """Tests for _search_api provider selection."""
+    
+    @pytest.fixture
+    def both_keys(self, monkeypatch):
+        """Configure both Tavily and SerpAPI keys."""
+        monkeypatch.setenv("TAVILY_API_KEY", "tavily-key")
+        monkeypatch.setenv("SERPAPI_API_KEY", "serp-key")
+    
+    def test_returns_none_without_keys(self, main_module, monkeypatch):
+        """Test _search_api returns None when no search API is configured."""
+        monkeypatch.delenv("TAVILY_API_KEY", raising=False)
+        monkeypatch.delenv("SERPAPI_API_KEY", raising=False)
+        assert main_module._search_api("Tokyo weather") is None
+    
+    def test_falls_back_to_serpapi(self, main_module, both_keys, monkeypatch):
+        """Test SerpAPI is tried when Tavily returns nothing."""
+        monkeypatch.setattr(main_module, "_tavily_search", lambda query, key: None)
+        monkeypatch.setattr(main_module, "_serpapi_search", lambda query, key: "serp result")
+        assert main_module._search_api("Tokyo weather") == "serp result"
+    
+    def test_sequential_prefers_tavily(self, main_module, both_keys, monkeypatch):
+        """Test SerpAPI is not called when Tavily succeeds."""
+        serp_calls = []
+        monkeypatch.setattr(main_module, "_tavily_search", lambda query, key: "tavily result")
+        monkeypatch.setattr(main_module, "_serpapi_search", lambda query, key: serp_calls.append(query))
+        assert main_module._search_api("Tokyo weather") == "tavily result"
+        assert serp_calls == []
+    
+    def test_speculative_returns_first_success(self, main_module, both_keys, monkeypatch):
+        """Test speculative mode doesn't wait on a slow provider."""
+        import threading
+        release = threading.Event()
+        
+        def slow_tavily(query, key):
+            release.wait(5)
+            return "tavily result"
+        
+        monkeypatch.setattr(main_module, "SPECULATIVE_SEARCH", True)
+        monkeypatch.setattr(main_module, "_tavily_search", slow_tavily)
+        monkeypatch.setattr(main_module, "_serpapi_search", lambda query, key: "serp result")
+        try:
+            assert main_module._search_api("Tokyo weather") == "serp result"
+        finally:
+            release.set()
+    
+    def test_speculative_returns_none_when_all_fail(self, main_module, both_keys, monkeypatch):
+        """Test speculative mode returns None when every provider fails."""
+        monkeypatch.setattr(main_module, "SPECULATIVE_SEARCH", True)
+        monkeypatch.setattr(main_module, "_tavily_search", lambda query, key: None)
+        monkeypatch.setattr(main_module, "_serpapi_search", lambda query, key: None)
+        assert main_module._search_api("Tokyo weather") is None
+
+
+class TestSearchProviders:
+    """Tests for the Tavily and SerpAPI clients against a mock transport."""
+    
+    @pytest.fixture
+    def routes(self, main_module, monkeypatch):
+        """Serve canned responses per search host; tests may override a host's (status, body)."""
+        table = {
+            "api.tavily.com": (200, TAVILY_BODY),
+            "serpapi.com": (200, SERPAPI_BODY),
+        }
+        
+        def handler(request):
+            status, body = table[request.url.host]
+            return httpx.Response(status, content=body)
+        
+        for name in ("tavily", "serpapi"):
+            monkeypatch.setitem(main_module._SEARCH_BREAKERS, name, main_module.CircuitBreaker())
+        with httpx.Client(transport=httpx.MockTransport(handler)) as client:
+            monkeypatch.setattr(main_module, "_HTTP_CLIENT", client)
+            yield table
+    
+    def test_tavily_combines_answer_and_snippets(self, main_module, routes):
+        """Test Tavily's answer and result snippets are joined into one summary."""
+        result = main_module._tavily_search("Tokyo", "key")
+        assert result == "Tokyo is best in spring. Cherry blossoms peak in April. Book early."
+    
+    def test_serpapi_joins_organic_snippets(self, main_module, routes):
+        """Test SerpAPI organic result snippets are joined into one summary."""
+        result = main_module._serpapi_search("Tokyo", "key")
+        assert result == "Visit Senso-ji early. Try Tsukiji."
+    
+    def test_rate_limited_provider_returns_none(self, main_module, routes):
+        """Test a 429 from SerpAPI yields None without tripping its breaker."""
+        routes["serpapi.com"] = (429, b"{}")
+        assert main_module._serpapi_search("Tokyo", "key") is None
+        assert not main_module._SEARCH_BREAKERS["serpapi"].is_open
+    
+    def test_search_api_falls_back_over_http(self, main_module, routes, monkeypatch):
+        """Test _search_api moves on to SerpAPI when Tavily returns an empty body."""
+        monkeypatch.setenv("TAVILY_API_KEY", "tavily-key")
+        monkeypatch.setenv("SERPAPI_API_KEY", "serp-key")
+        routes["api.tavily.com"] = (200, b"{}")
+        assert main_module._search_api("Tokyo") == "Visit Senso-ji early. Try Tsukiji."
+
 
+class TestCircuitBreaker:
+    """Tests for the search API circuit breaker."""
+    
+    @pytest.fixture
+    def tavily_status(self, main_module, monkeypatch):
+        """Route the shared HTTP client to a fake Tavily returning a configurable status."""
+        state = {"status": 503, "calls": 0}
+        
+        def handler(request):
+            state["calls"] += 1
+            return httpx.Response(state["status"], json={"answer": "ok", "results": []})
+        
+        monkeypatch.setitem(main_module._SEARCH_BREAKERS, "tavily", main_module.CircuitBreaker(fail_max=2, reset_timeout=30))
+        with httpx.Client(transport=httpx.MockTransport(handler)) as client:
+            monkeypatch.setattr(main_module, "_HTTP_CLIENT", client)
+            yield state
+    
+    def test_opens_after_consecutive_failures(self, main_module):
+        """Test the breaker rejects calls once fail_max is reached."""
+        breaker = main_module.CircuitBreaker(fail_max=2, reset_timeout=30)
+        breaker.record_failure()
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.is_open
+        assert not breaker.allow()
+    
+    def test_half_open_allows_single_probe(self, main_module, monkeypatch):
+        """Test one probe goes through after reset_timeout and success closes the breaker."""
+        clock = [100.0]
+        monkeypatch.setattr(main_module.time, "monotonic", lambda: clock[0])
+        breaker = main_module.CircuitBreaker(fail_max=1, reset_timeout=30)
+        breaker.record_failure()
+        assert not breaker.allow()
+        clock[0] += 31
+        assert breaker.allow()
+        assert not breaker.allow()  # Only one probe at a time
+        breaker.record_success()
+        assert not breaker.is_open
+        assert breaker.allow()
+    
+    def test_failed_probe_reopens(self, main_module, monkeypatch):
+        """Test a failing half-open probe re-opens the breaker."""
+        clock = [100.0]
+        monkeypatch.setattr(main_module.time, "monotonic", lambda: clock[0])
+        breaker = main_module.CircuitBreaker(fail_max=1, reset_timeout=30)
+        breaker.record_failure()
+        clock[0] += 31
+        assert breaker.allow()
+        breaker.record_failure()
+        assert not breaker.allow()
+    
+    def test_open_breaker_skips_upstream(self, main_module, tavily_status):
+        """Test Tavily isn't called once 5xx responses have opened the breaker."""
+        assert main_module._tavily_search("Tokyo", "key") is None
+        assert main_module._tavily_search("Tokyo", "key") is None
+        assert main_module._tavily_search("Tokyo", "key") is None
+        assert tavily_status["calls"] == 2
+    
+    def test_client_errors_do_not_trip(self, main_module, tavily_status):
+        """Test 4xx responses aren't counted as upstream failures."""
+        tavily_status["status"] = 401
+        for _ in range(3):
+            assert main_module._tavily_search("Tokyo", "key") is None
+        assert tavily_status["calls"] == 3
+        assert not main_module._SEARCH_BREAKERS["tavily"].is_open
+    
+    def test_rate_limited_probe_releases_breaker(self, main_module, tavily_status, monkeypatch):
+        """Test a 429 on the half-open probe closes the breaker instead of wedging it."""
+        clock = [100.0]
+        monkeypatch.setattr(main_module.time, "monotonic", lambda: clock[0])
+        main_module._tavily_search("Tokyo", "key")
+        main_module._tavily_search("Tokyo", "key")
+        assert main_module._SEARCH_BREAKERS["tavily"].is_open
+        
+        clock[0] += 31
+        tavily_status["status"] = 429
+        assert main_module._tavily_search("Tokyo", "key") is None
+        tavily_status["status"] = 200
+        assert main_module._tavily_search("Tokyo", "key") == "ok"
+        assert tavily_status["calls"] == 4
+    
+    def test_unexpected_error_releases_probe(self, main_module, monkeypatch):
+        """Test a probe that fails for a non-HTTP reason frees the slot for the next probe."""
+        clock = [100.0]
+        monkeypatch.setattr(main_module.time, "monotonic", lambda: clock[0])
+        breaker = main_module.CircuitBreaker(fail_max=1, reset_timeout=30)
+        breaker.record_failure()
+        clock[0] += 31
+        assert breaker.allow()
+        main_module._record_search_error(breaker, ValueError("bad payload"))
+        assert breaker.allow()
+    
+    def test_success_returns_answer(self, main_module, tavily_status):
+        """Test a 200 response is parsed and keeps the breaker closed."""
+        tavily_status["status"] = 200
+        assert main_module._tavily_search("Tokyo", "key") == "ok"
+        assert not main_module._SEARCH_BREAKERS["tavily"].is_open